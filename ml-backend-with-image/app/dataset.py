@@ -1,7 +1,14 @@
-import json
+import atexit
+import logging
+import queue
+import threading
 from pathlib import Path
 import os
 
+import orjson
+
+logger = logging.getLogger(__name__)
+
 # Always resolve the dataset path relative to this file so that it works
 # no matter where the application is started from (repo root, service dir, etc.)
 BASE_DIR = Path(__file__).resolve().parent.parent  # points to ml-backend-with-image/
@@ -10,63 +17,101 @@ DATA_FILE = BASE_DIR / "data" / "dataset.jsonl"
 # Ensure data directory exists and log path on module load
 try:
     DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-    print(f"[INIT] Dataset file path: {DATA_FILE.absolute()}")
-    print(f"[INIT] Dataset file exists: {DATA_FILE.exists()}")
-    print(f"[INIT] Dataset directory writable: {os.access(DATA_FILE.parent, os.W_OK)}")
+    logger.info("Dataset file path: %s (exists: %s, directory writable: %s)",
+                DATA_FILE.absolute(), DATA_FILE.exists(), os.access(DATA_FILE.parent, os.W_OK))
 except Exception as e:
-    print(f"[ERROR] Failed to create data directory: {str(e)}")
+    logger.error("Failed to create data directory: %s", e)
 
+# One append-only handle shared by the whole process. It is unbuffered, so each
+# write() is immediately visible to storage's readers.
+_write_lock = threading.Lock()
+_fh = None
 
-def save_report(report_dict: dict):
-    """Append raw report to dataset.jsonl (build dataset dynamically)."""
-    try:
-        # Ensure directory exists
+# Reports are serialized by the caller and appended by a single writer thread,
+# so requests don't wait on disk I/O. Readers call flush() first.
+_save_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _handle():
+    global _fh
+    if _fh is None or _fh.closed:
         DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Get absolute path for logging
-        abs_path = DATA_FILE.absolute()
-        
-        # Clean report_dict - remove non-serializable data
-        clean_report = {}
-        for key, value in report_dict.items():
-            # Skip image_bytes (can't serialize bytes to JSON)
-            if key == "image_bytes":
-                continue
-            # Convert any other non-serializable types
+        _fh = DATA_FILE.open("ab", buffering=0)
+    return _fh
+
+
+def _writer_loop():
+    while True:
+        lines = [_save_queue.get()]
+        # Append everything queued meanwhile in the same write()
+        while True:
             try:
-                json.dumps(value)  # Test if serializable
-                clean_report[key] = value
-            except (TypeError, ValueError):
-                # If not serializable, convert to string representation
-                clean_report[key] = str(value)
-                print(f"[WARNING] Converted non-serializable value for key '{key}' to string")
-        
-        # Write to file
-        with DATA_FILE.open("a", encoding="utf8") as f:
-            json_str = json.dumps(clean_report, ensure_ascii=False)
-            f.write(json_str + "\n")
-            f.flush()  # Force write to disk
-            os.fsync(f.fileno())  # Ensure data is written to disk
-        
-        # Verify file was written
-        if DATA_FILE.exists():
-            file_size = DATA_FILE.stat().st_size
-            print(f"[DEBUG] Report saved to dataset: {clean_report.get('report_id', 'unknown')}")
-            print(f"[DEBUG] Dataset file: {abs_path} (size: {file_size} bytes)")
-            print(f"[DEBUG] Report status: {clean_report.get('status', 'unknown')}, accept: {clean_report.get('accept', 'unknown')}")
-        else:
-            print(f"[ERROR] Dataset file does not exist after write: {abs_path}")
-        
-    except PermissionError as e:
-        print(f"[ERROR] Permission denied writing to dataset file: {str(e)}")
-        print(f"[ERROR] File path: {DATA_FILE.absolute()}")
-        print(f"[ERROR] Directory writable: {os.access(DATA_FILE.parent, os.W_OK)}")
-        raise
-    except Exception as e:
-        print(f"[ERROR] Failed to save report to dataset: {str(e)}")
-        print(f"[ERROR] File path: {DATA_FILE.absolute()}")
-        print(f"[ERROR] Report data keys: {list(report_dict.keys())}")
-        print(f"[ERROR] Report ID: {report_dict.get('report_id', 'unknown')}")
-        import traceback
-        print(traceback.format_exc())
+                lines.append(_save_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with _write_lock:
+                _handle().write(b"".join(lines))
+        except PermissionError as e:
+            logger.error("Permission denied writing %d report(s) to dataset file %s: %s (directory writable: %s)",
+                         len(lines), DATA_FILE.absolute(), e, os.access(DATA_FILE.parent, os.W_OK))
+        except Exception:
+            logger.exception("Failed to write %d report(s) to dataset file %s", len(lines), DATA_FILE.absolute())
+        finally:
+            for _ in lines:
+                _save_queue.task_done()
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="dataset-writer", daemon=True)
+            _writer.start()
+
+
+def flush():
+    """Block until every report queued by save_report is in dataset.jsonl."""
+    if _save_queue.unfinished_tasks:
+        _save_queue.join()
+
+
+def close():
+    """Write out pending reports and close the shared dataset handle (reopened
+    lazily on the next write)."""
+    global _fh
+    flush()
+    with _write_lock:
+        if _fh is not None and not _fh.closed:
+            _fh.close()
+        _fh = None
+
+
+atexit.register(close)
+
+
+def save_report(report_dict: dict):
+    """Queue raw report for appending to dataset.jsonl (build dataset dynamically).
+    Returns once the report is serialized; the write happens on the writer thread."""
+    # Skip image_bytes (can't serialize bytes to JSON); anything else orjson
+    # can't encode natively is stored as its string representation.
+    clean_report = {key: value for key, value in report_dict.items() if key != "image_bytes"}
+    try:
+        line = orjson.dumps(
+            clean_report,
+            default=str,
+            option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY,
+        )
+    except Exception:
+        logger.exception("Failed to serialize report %s for dataset file %s",
+                         report_dict.get("report_id", "unknown"), DATA_FILE.absolute())
         raise
+    _start_writer()
+    _save_queue.put_nowait(line)
+
+    logger.debug("Report queued for dataset: %s (status: %s, accept: %s)",
+                 clean_report.get("report_id", "unknown"),
+                 clean_report.get("status", "unknown"),
+                 clean_report.get("accept", "unknown"))
@@ -1,24 +1,619 @@
 # Lightweight CLIP-based image classifier with safe fallbacks.
 from PIL import Image
 import requests
+import hashlib
 import io
+import logging
+import mmap
+import os
+import queue
 import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the embedding file is then unlocked
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Intra-op threads for CLIP inference. Set before torch is imported (it is only
+# imported lazily via transformers) so OpenMP/MKL pick it up as well.
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_NUM_THREADS))
+
+# Concurrent classifications are coalesced into one CLIP forward: requests wait
+# up to CLIP_BATCH_WAIT_MS for company, and at most CLIP_BATCH_SIZE images go in
+# one batch. Batches only fill when ML_WORKERS lets several requests run at once.
+CLIP_BATCH_SIZE = max(1, int(os.getenv("CLIP_BATCH_SIZE", "16")))
+CLIP_BATCH_WAIT_MS = float(os.getenv("CLIP_BATCH_WAIT_MS", "10"))
+# The effective batch limit adapts AIMD-style (as in Clipper): +1 after a batch
+# that met CLIP_BATCH_SLO_MS, -10% after one that didn't.
+CLIP_BATCH_SLO_MS = float(os.getenv("CLIP_BATCH_SLO_MS", "200"))
+
+# CLIP_COMPILE=1 runs the vision tower through torch.compile (compiled during
+# warm_up, so startup gets slower and requests faster). Off by default.
+CLIP_COMPILE = os.getenv("CLIP_COMPILE", "0").strip().lower() in ("1", "true", "yes", "on")
+
+# Longest a classification waits for a background CLIP load before letting the
+# image through unchecked (a stalled weight download must not pin ML workers).
+CLIP_READY_TIMEOUT = float(os.getenv("CLIP_READY_TIMEOUT", "30"))
+
+# CLIP_DEVICE overrides where CLIP runs (default: cuda when available, else cpu).
+CLIP_DEVICE = os.getenv("CLIP_DEVICE", "").strip()
+
+# CLIP_PRECISION: "auto" (fp16 weights on cuda, fp32 on cpu), "fp16", "int8"
+# (dynamically quantized image encoder, cpu only; labels can differ from fp32)
+# or "fp32" (no conversion).
+CLIP_PRECISION = os.getenv("CLIP_PRECISION", "auto").strip().lower()
+
+# Image embeddings are cached by content hash so retried/duplicate uploads skip
+# the image encoder. They are stored int8-quantized with a per-vector scale
+# (~530 bytes each for ViT-B/32, vs 2 KB as fp32).
+CLIP_EMBED_CACHE_SIZE = int(os.getenv("CLIP_EMBED_CACHE_SIZE", "10000"))
+# Evicted/previous-run embeddings are kept in an append-only file that is
+# memory-mapped on load, so restarts don't re-encode everything. "" disables it.
+CLIP_EMBED_CACHE_FILE = os.getenv(
+    "CLIP_EMBED_CACHE_FILE",
+    str(Path(__file__).resolve().parent.parent / "data" / "clip_embeddings.bin"),
+)
+# Label text embeddings are computed at model load and kept on disk, keyed by
+# a hash of the model name and label set, so restarts skip the text encoder.
+CLIP_TEXT_CACHE_FILE = os.getenv(
+    "CLIP_TEXT_CACHE_FILE",
+    str(Path(__file__).resolve().parent.parent / "data" / "clip_text_embeddings.npz"),
+)
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+
+# Closed label vocabulary CLIP picks from (pipeline maps labels to categories).
+DEFAULT_LABELS = (
+    "road", "pothole", "crack", "broken road", "damaged road",
+    "road caved", "road sinking", "uneven road",
+    "traffic", "traffic jam", "congestion",
+    "signal", "traffic signal", "junction", "crossroad",
+    "accident", "collision", "crash", "hit",
+    "speed breaker", "speed bump", "divider",
+    "footpath", "sidewalk", "zebra crossing", "pedestrian",
+    "garbage", "trash", "waste", "dump", "dumping",
+    "garbage pile", "waste pile",
+    "dirty", "filthy", "unclean",
+    "bad smell", "toxic smell", "foul smell",
+    "dustbin", "overflowing bin",
+    "sanitation", "sewage", "sewer", "manhole",
+    "dead", "dead animal", "animal carcass",
+    "dead dog", "dead cat", "dead cow",
+    "dead body",
+    "mosquito", "flies", "infection", "disease",
+    "water", "no water", "low pressure",
+    "drinking water", "contaminated water",
+    "leak", "leakage", "pipe leak",
+    "pipe burst", "broken pipe",
+    "drain", "drainage", "blocked drain",
+    "overflow", "overflowing drain",
+    "flood", "waterlogging", "stagnant water",
+    "sewage water", "rain water",
+    "electricity", "electric", "power",
+    "no power", "power cut", "power outage",
+    "wire", "cable", "pole", "electric pole",
+    "transformer", "meter",
+    "short circuit", "spark",
+    "electrocution", "electric shock",
+    "live wire",
+    "streetlight", "street light", "lamp",
+    "lamp post", "pole light",
+    "not working", "broken light",
+    "flickering", "dim light",
+    "dark", "dark area", "no lighting",
+    "fire", "smoke", "burning",
+    "gas", "gas leak", "cylinder leak",
+    "collapse", "building collapse",
+    "wall collapse", "roof falling",
+    "crime", "theft", "robbery",
+    "violence", "fight", "assault",
+    "hazard", "danger", "unsafe",
+    "emergency", "life risk",
+    "park", "garden", "playground",
+    "children park", "public park",
+    "bench", "swing", "slide",
+    "walking track",
+    "tree", "fallen tree", "tree fallen",
+    "lawn", "grass", "maintenance",
+    "broken fence",
+)
+
+class _MapReader(io.RawIOBase):
+    """Seekable reader over an mmap with its own position, so decoding never
+    moves the map's shared cursor. Reads slice the map (no buffer export is
+    held, so the owner can close it once decoding is done)."""
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._data[self._pos:self._pos + len(b)]
+        b[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._data)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def open_image(data) -> Image.Image:
+    """Open upload data with PIL. An mmap of a spooled upload is read in place
+    rather than copied into a BytesIO first."""
+    if isinstance(data, mmap.mmap):
+        return Image.open(io.BufferedReader(_MapReader(data)))
+    return Image.open(io.BytesIO(data))
+
+
+# One pooled HTTP session for the URL-based (deprecated) helpers, so repeated
+# fetches reuse keep-alive connections instead of a new TCP/TLS handshake each.
+_http = requests.Session()
+
+
+def fetch_image(image_url: str, timeout: float) -> Image.Image:
+    """Download an image and decode it to RGB."""
+    resp = _http.get(image_url, timeout=timeout)
+    resp.raise_for_status()
+    return Image.open(io.BytesIO(resp.content)).convert("RGB")
+
 
 _clip_lock = threading.Lock()
 _clip_model = None
 _clip_processor = None
 _available = False
+_device = "cpu"
+_dtype = None  # floating dtype CLIP inputs are cast to (None: keep fp32)
+_precision = "fp32"  # CLIP_PRECISION actually applied to the loaded model
+_pinned = None  # page-locked staging buffer for batcher -> GPU copies
+# Cleared while initialize_clip_in_background is loading; set otherwise.
+_ready = threading.Event()
+_ready.set()
 
 def initialize_clip():
-    global _clip_model, _clip_processor, _available
+    global _clip_model, _clip_processor, _available, _device, _dtype, _precision
     try:
+        import torch
         from transformers import CLIPProcessor, CLIPModel
-        _clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-        _clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+        torch.set_num_threads(TORCH_NUM_THREADS)
+        _device = CLIP_DEVICE or ("cuda" if torch.cuda.is_available() else "cpu")
+        _clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).to(_device)
+        _clip_model.eval()
+        _precision, _dtype = _reduce_precision(torch)
+        if CLIP_COMPILE:
+            _compile_vision_model(torch)
+        _clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+        _open_embedding_store()
+        _label_embeddings(DEFAULT_LABELS)
         _available = True
-    except Exception as e:
+    except Exception:
         # Failed to load CLIP (no internet or packages). Continue with fallback.
+        logger.exception("CLIP load failed - image classification will use the fallback")
+        _available = False
+
+
+@contextmanager
+def _file_lock(fh):
+    """Exclusive advisory lock on an open file (a no-op where fcntl is missing)."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+class _EmbeddingStore:
+    """Append-only file of (blake2b key, scale, int8 embedding) records.
+
+    Layout: 48-byte header (magic/version, embedding dim, sha256 of the model
+    and precision the embeddings were computed with), then fixed-size records.
+    Reads go through a read-only np.memmap; the key -> record index is rebuilt
+    from the map when the store is opened.
+    Several processes (uvicorn workers) may share the file: appends hold an
+    exclusive flock and a record's index comes from where it actually landed,
+    and get() checks the stored key, treating a mismatch as a miss.
+    """
+    MAGIC = b"CLIPEMB3"
+    HEADER = 48
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.dtype = None
+        self.index = {}
+        self.count = 0  # records known to be in the file (mapped lazily)
+        self.records = None
+        self.fh = None
+
+    @staticmethod
+    def _key(key):
+        # S16 fields drop trailing NUL bytes when read back
+        return bytes(key).rstrip(b"\0")
+
+    def open(self, dim: int, tag: str):
+        self.close()
+        self.dtype = np.dtype([("h", "S16"), ("s", "<f2"), ("q", "i1", (dim,))])
+        header = (self.MAGIC + int(dim).to_bytes(4, "little") + bytes(4)
+                  + hashlib.sha256(tag.encode()).digest())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fh = open(self.path, "a+b", buffering=0)
+        try:
+            with _file_lock(fh):
+                fh.seek(0)
+                current = fh.read(self.HEADER) == header
+                if current:
+                    count = (fh.seek(0, os.SEEK_END) - self.HEADER) // self.dtype.itemsize
+                    # Drop a partial record left by an interrupted write
+                    fh.truncate(self.HEADER + count * self.dtype.itemsize)
+            if not current:
+                # Missing, foreign or written for another model/precision: start
+                # a new file. It replaces the old one rather than truncating it,
+                # so another process still mapping that file keeps valid pages.
+                fh.close()
+                tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp.write_bytes(header)
+                os.replace(tmp, self.path)
+                fh = open(self.path, "a+b", buffering=0)
+                count = 0
+        except BaseException:
+            fh.close()
+            raise
+        # Reads map the same open file the appends go to
+        self.fh = fh
+        self.count = count
+        self._map()
+        self.index = {key: i for i, key in enumerate(self.records["h"])} if count else {}
+
+    def _map(self):
+        self.records = np.memmap(self.fh, dtype=self.dtype, mode="r",
+                                 offset=self.HEADER, shape=(self.count,)) if self.count else None
+
+    def get(self, key):
+        key = self._key(key)
+        i = self.index.get(key)
+        if i is None:
+            return None
+        if self.records is None or i >= len(self.records):
+            self._map()  # appended since the last mapping
+        record = self.records[i]
+        if record["h"] != key:
+            return None  # not the record this index entry expected
+        return record["s"], np.array(record["q"])
+
+    def put(self, key, embedding):
+        key = self._key(key)
+        if self.fh is None or key in self.index:
+            return
+        record = np.empty(1, dtype=self.dtype)
+        record["h"] = key
+        record["s"], record["q"] = embedding
+        with _file_lock(self.fh):
+            end = self.fh.seek(0, os.SEEK_END)
+            i, partial = divmod(end - self.HEADER, self.dtype.itemsize)
+            if partial:
+                # Another process died mid-write: drop its partial record
+                self.fh.truncate(end - partial)
+            self.fh.write(record.tobytes())
+        self.index[key] = i
+        self.count = max(self.count, i + 1)
+
+    def close(self):
+        self.records = None
+        if self.fh is not None:
+            self.fh.close()
+        self.fh = None
+        self.index = {}
+        self.count = 0
+
+
+def _open_embedding_store():
+    global _embedding_store
+    if not CLIP_EMBED_CACHE_FILE:
+        return
+    try:
+        store = _EmbeddingStore(CLIP_EMBED_CACHE_FILE)
+        store.open(_clip_model.config.projection_dim, f"{CLIP_MODEL_NAME}\n{_precision}")
+        with _cache_lock:
+            _embedding_store = store
+    except Exception as e:
+        logger.warning("CLIP embedding cache file unavailable: %s", e)
+
+
+def _compile_vision_model(torch):
+    """Swap the vision tower for its torch.compile'd version (image path only)."""
+    try:
+        # Batch size varies with the micro-batcher, so compile for dynamic shapes
+        _clip_model.vision_model = torch.compile(_clip_model.vision_model, dynamic=True)
+    except Exception as e:
+        logger.warning("torch.compile unavailable, using eager CLIP: %s", e)
+
+
+def _reduce_precision(torch):
+    """Apply CLIP_PRECISION to the loaded model; returns the precision applied
+    ("fp16", "int8" or "fp32") and the input dtype to use."""
+    precision = CLIP_PRECISION
+    if precision == "auto":
+        precision = "fp16" if _device.startswith("cuda") else "fp32"
+    try:
+        if precision == "fp16":
+            _clip_model.half()
+            return "fp16", torch.float16
+        if precision == "int8":
+            # Dynamic int8 quantization of the image encoder's Linear layers (CPU only)
+            import warnings
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # torch.ao.quantization deprecation notices
+                from torch.ao.quantization import quantize_dynamic
+                _clip_model.vision_model = quantize_dynamic(
+                    _clip_model.vision_model, {torch.nn.Linear}, dtype=torch.qint8)
+                # quantize_dynamic only swaps child modules, so the bare
+                # projection Linear goes through a one-element container
+                _clip_model.visual_projection = quantize_dynamic(
+                    torch.nn.Sequential(_clip_model.visual_projection), {torch.nn.Linear}, dtype=torch.qint8)[0]
+            return "int8", None
+    except Exception as e:
+        logger.warning("CLIP %s conversion failed, using fp32: %s", precision, e)
+    return "fp32", None
+
+
+def initialize_clip_in_background(on_done=None):
+    """Load (and warm up) CLIP on a daemon thread so startup doesn't block on the
+    weight download; callers use wait_until_ready() before classifying.
+    `on_done` is called once loading has finished, whether or not it succeeded."""
+    _ready.clear()
+
+    def load():
+        try:
+            with _clip_lock:
+                if _clip_model is None:
+                    initialize_clip()
+            warm_up()
+        finally:
+            _ready.set()
+            if on_done is not None:
+                on_done()
+
+    threading.Thread(target=load, name="clip-init", daemon=True).start()
+
+
+def wait_until_ready(timeout=None) -> bool:
+    """Block while a background CLIP load is in flight (returns immediately otherwise)."""
+    return _ready.wait(timeout)
+
+
+def is_ready() -> bool:
+    """True once CLIP is loaded and usable."""
+    return _ready.is_set() and _available
+
+
+def release_clip():
+    """Drop the CLIP model and processor so their memory can be reclaimed."""
+    global _clip_model, _clip_processor, _available, _pinned
+    with _clip_lock:
+        _clip_model = None
+        _clip_processor = None
         _available = False
+        _pinned = None
+    global _embedding_store
+    with _cache_lock:
+        _embedding_cache.clear()
+        _text_embeddings.clear()
+        if _embedding_store is not None:
+            _embedding_store.close()
+        _embedding_store = None
+
+
+def warm_up():
+    """Run one dummy classification so the first real request doesn't pay for
+    lazy weight paging and kernel selection."""
+    if not _available:
+        return
+    buf = io.BytesIO()
+    Image.new("RGB", (224, 224)).save(buf, format="PNG")
+    classify_image_from_bytes(buf.getvalue())
+
+_cache_lock = threading.Lock()
+_embedding_cache = OrderedDict()  # blake2b(image bytes) -> (scale, int8 normalized image embedding)
+_text_embeddings = {}  # label tuple -> normalized fp32 text embeddings (labels x dim)
+_embedding_store = None  # on-disk second level behind _embedding_cache
+
+
+def _quantize(embedding):
+    """Symmetric per-vector int8 quantization: embedding ~= scale * q."""
+    peak = float(np.abs(embedding).max())
+    scale = peak / 127.0 if peak > 0 else 1.0
+    return np.float16(scale), np.round(embedding / scale).astype(np.int8)
+
+
+def _features(output):
+    # transformers 5 returns a model output whose pooler_output is the projection
+    return output if hasattr(output, "norm") else output.pooler_output
+
+
+def _to_device(inputs):
+    if _device == "cpu" and _dtype is None:
+        return inputs
+    return {name: tensor.to(_device, dtype=_dtype) if tensor.is_floating_point() else tensor.to(_device)
+            for name, tensor in inputs.items()}
+
+
+def _stage_pixels(pixel_values):
+    """Move a batch of pixel values to the GPU through a reused pinned buffer,
+    so the host-to-device copy is asynchronous and allocates nothing per batch."""
+    global _pinned
+    if _device == "cpu":
+        return pixel_values if _dtype is None else pixel_values.to(_dtype)
+    import torch
+    n = pixel_values.shape[0]
+    if _pinned is None or _pinned.shape[1:] != pixel_values.shape[1:] or _pinned.shape[0] < n:
+        _pinned = torch.empty((max(n, CLIP_BATCH_SIZE),) + tuple(pixel_values.shape[1:]),
+                              dtype=pixel_values.dtype, pin_memory=True)
+    staged = _pinned[:n]
+    staged.copy_(pixel_values)
+    # Safe to reuse on the next batch: the forward below syncs on .cpu()
+    return staged.to(_device, dtype=_dtype, non_blocking=True)
+
+
+def _label_set_key(labels) -> str:
+    return "k" + hashlib.sha256("\n".join((CLIP_MODEL_NAME, _precision) + tuple(labels)).encode()).hexdigest()
+
+
+def _load_text_cache() -> dict:
+    try:
+        with np.load(CLIP_TEXT_CACHE_FILE) as saved:
+            return {key: saved[key] for key in saved.files}
+    except Exception:
+        return {}  # missing or unreadable: recompute
+
+
+def _save_text_cache(key, embeddings):
+    try:
+        saved = _load_text_cache()
+        saved[key] = embeddings
+        tmp = CLIP_TEXT_CACHE_FILE + ".tmp.npz"
+        np.savez(tmp, **saved)
+        os.replace(tmp, CLIP_TEXT_CACHE_FILE)
+    except Exception as e:
+        logger.warning("Could not write CLIP text embedding cache: %s", e)
+
+
+def _label_embeddings(labels):
+    """Text embeddings for a label set, computed once per model load (and
+    read back from CLIP_TEXT_CACHE_FILE when a previous run saved them)."""
+    cached = _text_embeddings.get(labels)
+    if cached is not None:
+        return cached
+    key = _label_set_key(labels) if CLIP_TEXT_CACHE_FILE else None
+    if key is not None:
+        saved = _load_text_cache().get(key)
+        if saved is not None and saved.shape[0] == len(labels):
+            with _cache_lock:
+                _text_embeddings[labels] = saved
+            return saved
+    import torch
+    inputs = _clip_processor(text=list(labels), return_tensors="pt", padding=True)
+    with torch.inference_mode():
+        features = _features(_clip_model.get_text_features(**_to_device(inputs)))
+    features = features / features.norm(dim=-1, keepdim=True)
+    with _cache_lock:
+        _text_embeddings[labels] = embeddings = features.float().cpu().numpy()
+    if key is not None:
+        _save_text_cache(key, embeddings)
+    return embeddings
+
+
+def _cached_embedding(key):
+    with _cache_lock:
+        embedding = _embedding_cache.get(key)
+        if embedding is not None:
+            _embedding_cache.move_to_end(key)
+            return embedding
+        if _embedding_store is not None:
+            embedding = _embedding_store.get(key)
+            if embedding is not None:
+                _remember(key, embedding)
+        return embedding
+
+
+def _remember(key, embedding):
+    _embedding_cache[key] = embedding
+    if len(_embedding_cache) > CLIP_EMBED_CACHE_SIZE:
+        _embedding_cache.popitem(last=False)
+
+
+def _store_embedding(key, embedding):
+    with _cache_lock:
+        _remember(key, embedding)
+        if _embedding_store is not None:
+            _embedding_store.put(key, embedding)
+
+
+_batch_queue = queue.SimpleQueue()
+_batcher_thread = None
+_batcher_lock = threading.Lock()
+
+
+def _run_batch(batch):
+    """One CLIP image-encoder forward for a list of (image, future)."""
+    try:
+        import torch
+        inputs = _clip_processor(images=[image for image, _ in batch], return_tensors="pt")
+        with torch.inference_mode():
+            features = _features(_clip_model.get_image_features(
+                pixel_values=_stage_pixels(inputs["pixel_values"])))
+        features = features / features.norm(dim=-1, keepdim=True)
+        for (_, future), row in zip(batch, features.float().cpu().numpy()):
+            future.set_result(row)
+    except Exception as e:
+        for _, future in batch:
+            future.set_exception(e)
+
+
+def _adapt_batch_limit(limit: int, elapsed_ms: float) -> int:
+    if elapsed_ms > CLIP_BATCH_SLO_MS:
+        return max(1, min(limit - 1, int(limit * 0.9)))
+    return min(CLIP_BATCH_SIZE, limit + 1)
+
+
+def _batch_loop():
+    limit = CLIP_BATCH_SIZE
+    while True:
+        batch = [_batch_queue.get()]
+        deadline = time.monotonic() + CLIP_BATCH_WAIT_MS / 1000.0
+        while len(batch) < limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        started = time.monotonic()
+        _run_batch(batch)
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        # Only a full batch says anything about whether a bigger one would fit
+        if len(batch) >= limit or elapsed_ms > CLIP_BATCH_SLO_MS:
+            limit = _adapt_batch_limit(limit, elapsed_ms)
+
+
+def _embed_batched(image):
+    """Queue an image for the batcher thread and wait for its embedding."""
+    global _batcher_thread
+    if _batcher_thread is None:
+        with _batcher_lock:
+            if _batcher_thread is None:
+                _batcher_thread = threading.Thread(target=_batch_loop, name="clip-batcher", daemon=True)
+                _batcher_thread.start()
+    future = Future()
+    _batch_queue.put((image, future))
+    return future.result()
+
 
 def classify_image(image_url: str, candidate_labels=None) -> str:
     """Return best matching label from candidate_labels or 'other' on failure.
@@ -33,69 +628,7 @@ def classify_image(image_url: str, candidate_labels=None) -> str:
                 initialize_clip()
     
     if candidate_labels is None:
-        candidate_labels = [
-     "road", "pothole", "crack", "broken road", "damaged road",
-        "road caved", "road sinking", "uneven road",
-        "traffic", "traffic jam", "congestion",
-        "signal", "traffic signal", "junction", "crossroad",
-        "accident", "collision", "crash", "hit",
-        "speed breaker", "speed bump", "divider",
-        "footpath", "sidewalk", "zebra crossing", "pedestrian",
-
-        "garbage", "trash", "waste", "dump", "dumping",
-        "garbage pile", "waste pile",
-        "dirty", "filthy", "unclean",
-        "bad smell", "toxic smell", "foul smell",
-        "dustbin", "overflowing bin",
-        "sanitation", "sewage", "sewer", "manhole",
-
-        # DEAD ANIMAL (strict & safe)
-        "dead", "dead animal", "animal carcass",
-        "dead dog", "dead cat", "dead cow",
-        "dead body",
-
-        "mosquito", "flies", "infection", "disease",
-
-        "water", "no water", "low pressure",
-        "drinking water", "contaminated water",
-        "leak", "leakage", "pipe leak",
-        "pipe burst", "broken pipe",
-        "drain", "drainage", "blocked drain",
-        "overflow", "overflowing drain",
-        "flood", "waterlogging", "stagnant water",
-        "sewage water", "rain water",
-
-        "electricity", "electric", "power",
-        "no power", "power cut", "power outage",
-        "wire", "cable", "pole", "electric pole",
-        "transformer", "meter",
-        "short circuit", "spark",
-        "electrocution", "electric shock",
-        "live wire",
-
-        "streetlight", "street light", "lamp",
-        "lamp post", "pole light",
-        "not working", "broken light",
-        "flickering", "dim light",
-        "dark", "dark area", "no lighting",
-
-         "fire", "smoke", "burning",
-        "gas", "gas leak", "cylinder leak",
-        "collapse", "building collapse",
-        "wall collapse", "roof falling",
-        "crime", "theft", "robbery",
-        "violence", "fight", "assault",
-        "hazard", "danger", "unsafe",
-        "emergency", "life risk",
-
-        "park", "garden", "playground",
-        "children park", "public park",
-        "bench", "swing", "slide",
-        "walking track",
-        "tree", "fallen tree", "tree fallen",
-        "lawn", "grass", "maintenance",
-        "broken fence"
-]
+        candidate_labels = DEFAULT_LABELS
 
 
     if not image_url:
@@ -110,11 +643,11 @@ def classify_image(image_url: str, candidate_labels=None) -> str:
         return "other"
 
     try:
-        resp = requests.get(image_url, timeout=5)
-        resp.raise_for_status()
-        image = Image.open(io.BytesIO(resp.content)).convert("RGB")
+        import torch
+        image = fetch_image(image_url, timeout=5)
         inputs = _clip_processor(text=candidate_labels, images=image, return_tensors="pt", padding=True)
-        outputs = _clip_model(**inputs)
+        with torch.inference_mode():
+            outputs = _clip_model(**_to_device(inputs))
         logits_per_image = outputs.logits_per_image  # shape (1, num_labels)
         probs = logits_per_image.softmax(dim=1)
         best = int(probs.argmax().item())
@@ -123,9 +656,10 @@ def classify_image(image_url: str, candidate_labels=None) -> str:
         return "other"
 
 
-def classify_image_from_bytes(image_bytes: bytes, candidate_labels=None) -> str:
+def classify_image_from_bytes(image_bytes: bytes, candidate_labels=None, image=None) -> str:
     """Return best matching label from candidate_labels or 'other' on failure.
-    Works with image bytes directly (no URL required).
+    Works with image bytes directly (no URL required). Pass the already
+    decoded RGB `image` to skip decoding the bytes again on a cache miss.
     CLIP model is loaded lazily (on first use) to save memory.
     """
     # Lazy load CLIP model if not already loaded
@@ -136,60 +670,7 @@ def classify_image_from_bytes(image_bytes: bytes, candidate_labels=None) -> str:
                 initialize_clip()
     
     if candidate_labels is None:
-        candidate_labels = [
-            "road", "pothole", "crack", "broken road", "damaged road",
-            "road caved", "road sinking", "uneven road",
-            "traffic", "traffic jam", "congestion",
-            "signal", "traffic signal", "junction", "crossroad",
-            "accident", "collision", "crash", "hit",
-            "speed breaker", "speed bump", "divider",
-            "footpath", "sidewalk", "zebra crossing", "pedestrian",
-            "garbage", "trash", "waste", "dump", "dumping",
-            "garbage pile", "waste pile",
-            "dirty", "filthy", "unclean",
-            "bad smell", "toxic smell", "foul smell",
-            "dustbin", "overflowing bin",
-            "sanitation", "sewage", "sewer", "manhole",
-            "dead", "dead animal", "animal carcass",
-            "dead dog", "dead cat", "dead cow",
-            "dead body",
-            "mosquito", "flies", "infection", "disease",
-            "water", "no water", "low pressure",
-            "drinking water", "contaminated water",
-            "leak", "leakage", "pipe leak",
-            "pipe burst", "broken pipe",
-            "drain", "drainage", "blocked drain",
-            "overflow", "overflowing drain",
-            "flood", "waterlogging", "stagnant water",
-            "sewage water", "rain water",
-            "electricity", "electric", "power",
-            "no power", "power cut", "power outage",
-            "wire", "cable", "pole", "electric pole",
-            "transformer", "meter",
-            "short circuit", "spark",
-            "electrocution", "electric shock",
-            "live wire",
-            "streetlight", "street light", "lamp",
-            "lamp post", "pole light",
-            "not working", "broken light",
-            "flickering", "dim light",
-            "dark", "dark area", "no lighting",
-            "fire", "smoke", "burning",
-            "gas", "gas leak", "cylinder leak",
-            "collapse", "building collapse",
-            "wall collapse", "roof falling",
-            "crime", "theft", "robbery",
-            "violence", "fight", "assault",
-            "hazard", "danger", "unsafe",
-            "emergency", "life risk",
-            "park", "garden", "playground",
-            "children park", "public park",
-            "bench", "swing", "slide",
-            "walking track",
-            "tree", "fallen tree", "tree fallen",
-            "lawn", "grass", "maintenance",
-            "broken fence"
-        ]
+        candidate_labels = DEFAULT_LABELS
 
     if not image_bytes:
         return "other"
@@ -199,16 +680,20 @@ def classify_image_from_bytes(image_bytes: bytes, candidate_labels=None) -> str:
         return "other"
 
     try:
-        # Open image directly from bytes
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        inputs = _clip_processor(text=candidate_labels, images=image, return_tensors="pt", padding=True)
-        outputs = _clip_model(**inputs)
-        logits_per_image = outputs.logits_per_image  # shape (1, num_labels)
-        probs = logits_per_image.softmax(dim=1)
-        best = int(probs.argmax().item())
-        return candidate_labels[best]
+        key = hashlib.blake2b(image_bytes, digest_size=16).digest()
+        embedding = _cached_embedding(key)
+        if embedding is None:
+            # Open image directly from bytes (decoded here, in the caller's thread)
+            if image is None:
+                image = open_image(image_bytes).convert("RGB")
+            embedding = _quantize(_embed_batched(image))
+            _store_embedding(key, embedding)
+        labels = tuple(candidate_labels)
+        # Cosine similarity ranks labels exactly like CLIP's softmax over logits;
+        # the positive per-vector scale doesn't change the ranking, so the int8
+        # vector is scored directly.
+        scores = _label_embeddings(labels) @ embedding[1].astype(np.float32)
+        return labels[int(scores.argmax())]
     except Exception as e:
-        print(f"[ERROR] Image classification failed: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Image classification failed: %s", e)
         return "other"
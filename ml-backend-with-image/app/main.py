@@ -1,42 +1,136 @@
 from fastapi import FastAPI, HTTPException, Request, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from contextlib import asynccontextmanager
+from types import MappingProxyType
 from typing import Optional
-import traceback
+from pydantic import TypeAdapter, ValidationError
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
 import os
 import sys
 import json
+import logging
+import mmap
+import logging.handlers
+import queue
+import atexit
+import orjson
+
+from app.models import ReportFormFields
+
+# Configure logging before the ML modules are imported so their module-level
+# messages are emitted too. DEBUG adds per-request details.
+# Request handlers only enqueue records; a listener thread does the formatting
+# and the blocking stream writes, keeping stdio off the event loop.
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+_root_logger = logging.getLogger()
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, *_root_logger.handlers, respect_handler_level=True
+)
+_root_logger.handlers = [logging.handlers.QueueHandler(_log_queue)]
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logger = logging.getLogger(__name__)
+
+
+class ORJSONResponse(Response):
+    """JSON response rendered with orjson instead of the stdlib json encoder."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content,
+            default=str,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
 
-# Initialize app first - this must work
-app = FastAPI(title="Civic ML Backend API", version="1.0.0")
+
+def _env_flag(name: str, default: bool = True) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off", "")
+
+
+# ML_ENABLED=0 runs the API without the ML pipeline (default responses only).
+# PRELOAD_MODEL=0 skips loading CLIP at startup; it is then loaded on first use.
+ML_ENABLED = _env_flag("ML_ENABLED")
+PRELOAD_MODEL = _env_flag("PRELOAD_MODEL")
+# ML_WORKERS bounds how many classifications (CLIP forwards) run at once, off
+# the event loop, so uploads keep being accepted while the model is busy.
+ML_WORKERS = max(1, int(os.getenv("ML_WORKERS", "2")))
+# Created per lifespan (a shut-down pool can't be reused by the next one);
+# None, outside a lifespan, means the event loop's default executor.
+_ml_executor = None
 
 # Try to import ML modules - make them optional so app can start even if they fail
 classify_report = None
+initialize_models = None
+release_models = None
+models_ready = None
 ml_available = False
 
-try:
-    from app.pipeline import classify_report, initialize_models
-    ml_available = True
-    print("[OK] ML modules loaded successfully")
-    # Initialize ML models (CLIP, etc.) on startup
-    print("Initializing ML models...")
+if ML_ENABLED:
     try:
-        initialize_models()
-        print("[OK] ML models initialized successfully")
-    except Exception as init_error:
-        print(f"[WARN] ML model initialization failed (will use fallback): {init_error}")
-        ml_available = False
-except Exception as e:
-    print(f"[WARN] ML modules not available (non-critical): {e}")
-    print("[WARN] API will return default responses")
-
-# Log startup information
-print("=" * 50)
-print("ML Backend API Starting...")
-print(f"Python version: {sys.version}")
-print(f"Working directory: {os.getcwd()}")
-print(f"ML Available: {ml_available}")
-print("=" * 50)
+        from app.pipeline import classify_report, initialize_models, release_models, models_ready
+        ml_available = True
+        logger.info("ML modules loaded successfully")
+    except Exception as e:
+        logger.warning("ML modules not available (non-critical): %s", e)
+        logger.warning("API will return default responses")
+else:
+    logger.warning("ML disabled via ML_ENABLED - API will return default responses")
+
+
+def _on_models_ready():
+    # Called from the loader thread once the background load has finished
+    if models_ready():
+        logger.info("ML model loading finished")
+    else:
+        logger.warning("ML model loading failed - image classification will use the fallback")
+    _render_health_bodies()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start loading ML models (CLIP, etc.) in the background as soon as the
+    worker starts, so it can answer health checks right away and the first
+    /submit only waits for whatever is left of the load; release them on
+    shutdown."""
+    global _ml_executor
+    _ml_executor = executor = ThreadPoolExecutor(max_workers=ML_WORKERS, thread_name_prefix="ml")
+    if ml_available and PRELOAD_MODEL:
+        # Load failures are reported through _on_models_ready
+        logger.info("Loading ML models in the background...")
+        initialize_models(on_ready=_on_models_ready)
+
+    # Log startup information
+    logger.info("ML Backend API Starting... (Python %s, working directory: %s, ML available: %s)",
+                sys.version.split()[0], os.getcwd(), ml_available)
+    _render_health_bodies()
+    yield
+
+    # Let in-flight classifications finish before the models go away,
+    # waiting on a thread so the event loop isn't blocked meanwhile.
+    _ml_executor = None
+    await asyncio.to_thread(executor.shutdown, wait=True)
+    if release_models is not None:
+        release_models()
+
+
+# Initialize app first - this must work
+app = FastAPI(
+    title="Civic ML Backend API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # CORS configuration - SIMPLIFIED AND RELIABLE
 app.add_middleware(
@@ -49,25 +143,156 @@ app.add_middleware(
     max_age=3600,  # Cache preflight for 1 hour
 )
 
-print("=" * 50)
-print("CORS Configuration:")
-print("  allow_origins: ['*'] (all origins)")
-print("  allow_credentials: False")
-print("=" * 50)
+logger.info("CORS configuration: allow_origins=['*'] (all origins), allow_credentials=False")
+
+MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
+IMAGE_READ_CHUNK = 64 * 1024
+# Starlette spools multipart uploads larger than this to a temp file
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+
+# Client-facing 422 messages, formatted only when an error is actually raised.
+_TEMPLATES = {
+    "required": "Validation error: '{field}' is required and cannot be empty",
+    "not_a_number": "Validation error: '{field}' must be a valid number, got '{value}'",
+    "out_of_range": "Validation error: '{field}' must be between -{limit} and {limit}, got {value}",
+    "image_empty": "Validation error: Image file is empty",
+    "image_too_large": "Validation error: Image file too large. Maximum size is {max_mb:.1f}MB, got {size_mb:.1f}MB",
+    "image_unsupported": "Validation error: Unsupported image format. Expected JPEG, PNG, GIF or WebP",
+    "image_unreadable": "Validation error: Failed to read image file: {error}",
+}
+
+
+def _err(code: str, **kw) -> HTTPException:
+    return HTTPException(status_code=422, detail=_TEMPLATES[code].format(**kw))
+
+
+def _image_too_large(size: int) -> HTTPException:
+    return _err("image_too_large", max_mb=MAX_IMAGE_SIZE / (1024*1024), size_mb=size / (1024*1024))
+
+
+# Leading magic bytes of the accepted formats (JPEG, PNG, GIF); WebP is a RIFF
+# container with "WEBP" at offset 8, so 12 bytes are enough to decide.
+_IMAGE_MAGIC = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8")
+_IMAGE_SNIFF_LEN = 12
+
+
+def _looks_like_image(head) -> bool:
+    return head.startswith(_IMAGE_MAGIC) or (head.startswith(b"RIFF") and head.startswith(b"WEBP", 8))
+
+
+async def _read_image(image: UploadFile):
+    """Read an uploaded image in chunks, giving up as soon as it exceeds
+    MAX_IMAGE_SIZE or its header isn't a supported image format, instead of
+    materializing the whole upload first. Uploads that were already spooled
+    to disk are returned as a read-only mmap instead of bytes."""
+    if image.size is not None and image.size > MAX_IMAGE_SIZE:
+        raise _image_too_large(image.size)
+
+    if image.size is not None and image.size > UPLOAD_SPOOL_SIZE:
+        # Starlette already spooled this upload to a temp file: check its
+        # header and map the file read-only instead of copying it into memory.
+        # _classify closes the map once classification is done.
+        await image.seek(0)
+        if not _looks_like_image(await image.read(_IMAGE_SNIFF_LEN)):
+            raise _err("image_unsupported")
+        try:
+            fileno = image.file.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fileno = None  # not backed by a real file: read it below
+        if fileno is not None:
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        await image.seek(0)
+
+    buf = bytearray()
+    sniffed = False
+    while chunk := await image.read(IMAGE_READ_CHUNK):
+        buf.extend(chunk)
+        if not sniffed and len(buf) >= _IMAGE_SNIFF_LEN:
+            if not _looks_like_image(buf):
+                await image.close()
+                raise _err("image_unsupported")
+            sniffed = True
+        if len(buf) > MAX_IMAGE_SIZE:
+            await image.close()
+            raise _image_too_large(len(buf))
+    if buf and not sniffed and not _looks_like_image(buf):
+        raise _err("image_unsupported")
+    return bytes(buf)
+
+
+def _render_health_bodies():
+    """Pre-serialize the health responses; they only change when ml_available
+    or model readiness does."""
+    global _ROOT_BODY, _HEALTH_BODY
+    model_ready = models_ready() if models_ready is not None else False
+    _ROOT_BODY = orjson.dumps({"status": "ML API running", "version": "1.0.0", "ml_available": ml_available})
+    _HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "ML Backend", "ml_available": ml_available,
+                                 "model_ready": model_ready})
+
+
+_render_health_bodies()
+_OPTIONS_BODY = orjson.dumps({"status": "ok"})
+
 
 @app.get("/")
 def health():
-    return {"status": "ML API running", "version": "1.0.0", "ml_available": ml_available}
+    return Response(_ROOT_BODY, media_type="application/json")
 
 @app.get("/health")
 def health_check():
     """Health check endpoint for Render"""
-    return {"status": "healthy", "service": "ML Backend", "ml_available": ml_available}
+    return Response(_HEALTH_BODY, media_type="application/json")
 
 @app.options("/submit")
 async def submit_options():
     """Handle CORS preflight requests"""
-    return {"status": "ok"}
+    return Response(_OPTIONS_BODY, media_type="application/json")
+
+# Required /submit response keys, used where the classifier result lacks them.
+_BASE_RESULT = MappingProxyType({"accept": False, "status": "error", "category": "Other", "confidence": 0.0})
+_UNAVAILABLE_RESULT = MappingProxyType({
+    "report_id": None, "accept": False, "status": "unavailable", "category": "Other",
+    "confidence": 0.0, "reason": "ML backend offline",
+})
+
+# Compiled once at import; pydantic-core does the strip/type/range checks.
+_form_adapter = TypeAdapter(ReportFormFields)
+_COORD_RANGES = {"latitude": 90, "longitude": 180}
+
+
+def _validate_form(report_id, description, user_id, latitude, longitude) -> ReportFormFields:
+    """Validate the raw /submit form strings, reporting the first error as a 422."""
+    try:
+        return _form_adapter.validate_python({
+            "report_id": report_id or "",
+            "description": description or "",
+            "user_id": user_id,
+            "latitude": latitude or None,
+            "longitude": longitude or None,
+        })
+    except ValidationError as exc:
+        error = exc.errors()[0]
+        field = error["loc"][0]
+        if field not in _COORD_RANGES:
+            raise _err("required", field=field)
+        value = latitude if field == "latitude" else longitude
+        if error["type"] in ("greater_than_equal", "less_than_equal"):
+            raise _err("out_of_range", field=field, limit=_COORD_RANGES[field], value=float(value))
+        raise _err("not_a_number", field=field, value=value)
+
+
+def _classify(report_data):
+    """classify_report as run on the ML executor. An mmap'd upload is closed
+    here, after the classification that reads it has finished, and never
+    from the event loop while a worker may still be using it."""
+    try:
+        return classify_report(report_data)
+    finally:
+        image_bytes = report_data.get("image_bytes")
+        if isinstance(image_bytes, mmap.mmap):
+            image_bytes.close()
+
 
 @app.post("/submit")
 async def submit_report(
@@ -92,92 +317,40 @@ async def submit_report(
     Returns a JSON response with classification results.
     """
     try:
-        print(f"Received ML validation request: report_id={report_id}, description_length={len(description or '')}")
-        
-        # Validate required fields with clear error messages
-        if not report_id or not report_id.strip():
-            raise HTTPException(
-                status_code=422,
-                detail="Validation error: 'report_id' is required and cannot be empty"
-            )
-        if not description or not description.strip():
-            raise HTTPException(
-                status_code=422,
-                detail="Validation error: 'description' is required and cannot be empty"
-            )
+        logger.info("Received ML validation request: report_id=%s, description_length=%d",
+                    report_id, len(description or ''))
         
-        # Clean up string fields
-        report_id = report_id.strip()
-        description = description.strip()
-        user_id = user_id.strip() if user_id else None
+        form = _validate_form(report_id, description, user_id, latitude, longitude)
+        report_id = form.report_id
+        description = form.description
+        user_id = form.user_id
+        latitude_float = form.latitude
+        longitude_float = form.longitude
         
-        # Validate and convert latitude
-        latitude_float = None
-        if latitude:
-            try:
-                latitude_float = float(latitude.strip())
-                if not (-90 <= latitude_float <= 90):
-                    raise HTTPException(
-                        status_code=422,
-                        detail=f"Validation error: 'latitude' must be between -90 and 90, got {latitude_float}"
-                    )
-            except HTTPException:
-                raise  # Re-raise HTTPException as-is
-            except (ValueError, TypeError) as e:
-                raise HTTPException(
-                    status_code=422,
-                    detail=f"Validation error: 'latitude' must be a valid number, got '{latitude}'"
-                )
-        
-        # Validate and convert longitude
-        longitude_float = None
-        if longitude:
-            try:
-                longitude_float = float(longitude.strip())
-                if not (-180 <= longitude_float <= 180):
-                    raise HTTPException(
-                        status_code=422,
-                        detail=f"Validation error: 'longitude' must be between -180 and 180, got {longitude_float}"
-                    )
-            except HTTPException:
-                raise  # Re-raise HTTPException as-is
-            except (ValueError, TypeError) as e:
-                raise HTTPException(
-                    status_code=422,
-                    detail=f"Validation error: 'longitude' must be a valid number, got '{longitude}'"
-                )
+        # Without the ML modules there is nothing to classify: answer before
+        # pulling the (possibly 10MB) image off the upload.
+        if classify_report is None:
+            return ORJSONResponse({**_UNAVAILABLE_RESULT, "report_id": report_id})
         
         # Read and validate image file if provided
         image_bytes = None
-        MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
         if image:
             try:
                 # Check content type if available (informational only, not strict)
                 if image.content_type:
                     allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/webp']
                     if image.content_type not in allowed_types:
-                        print(f"Warning: Unexpected content type '{image.content_type}', continuing anyway")
+                        logger.warning("Unexpected content type '%s', continuing anyway", image.content_type)
                 
                 # Read image with size limit
-                image_bytes = await image.read()
-                if len(image_bytes) > MAX_IMAGE_SIZE:
-                    raise HTTPException(
-                        status_code=422,
-                        detail=f"Validation error: Image file too large. Maximum size is {MAX_IMAGE_SIZE / (1024*1024):.1f}MB, got {len(image_bytes) / (1024*1024):.1f}MB"
-                    )
+                image_bytes = await _read_image(image)
                 if len(image_bytes) == 0:
-                    raise HTTPException(
-                        status_code=422,
-                        detail="Validation error: Image file is empty"
-                    )
-                print(f"Received image: {len(image_bytes)} bytes, content_type: {image.content_type}")
+                    raise _err("image_empty")
+                logger.debug("Received image: %d bytes, content_type: %s", len(image_bytes), image.content_type)
             except HTTPException:
                 raise
             except Exception as e:
-                raise HTTPException(
-                    status_code=422,
-                    detail=f"Validation error: Failed to read image file: {str(e)}"
-                )
+                raise _err("image_unreadable", error=e)
         
         # Prepare report data
         report_data = {
@@ -190,58 +363,56 @@ async def submit_report(
         }
         
         # Classify the report using ML
-        print("Starting ML classification...")
-        print(f"Report data keys: {list(report_data.keys())}")
-        print(f"Has image_bytes: {bool(report_data.get('image_bytes'))}")
-        if report_data.get('image_bytes'):
-            print(f"Image bytes size: {len(report_data.get('image_bytes'))} bytes")
+        logger.debug("Starting ML classification (has image: %s)", image_bytes is not None)
         
         try:
-            result = classify_report(report_data)
-            print(f"ML classification complete: status={result.get('status')}, category={result.get('category')}, confidence={result.get('confidence')}")
+            # CPU-bound (CLIP forward, dataset I/O): keep it off the event loop
+            result = await asyncio.get_running_loop().run_in_executor(_ml_executor, _classify, report_data)
+            logger.info("ML classification complete: report_id=%s, status=%s, category=%s, confidence=%s",
+                        report_id, result.get('status'), result.get('category'), result.get('confidence'))
             
             # Ensure result has all required fields
             if not isinstance(result, dict):
                 raise ValueError(f"classify_report returned non-dict: {type(result)}")
             
-            # Ensure result has required keys
-            if 'report_id' not in result:
-                result['report_id'] = report_id
-            if 'accept' not in result:
-                result['accept'] = False
-            if 'status' not in result:
-                result['status'] = 'error'
-            if 'category' not in result:
-                result['category'] = 'Other'
-            if 'confidence' not in result:
-                result['confidence'] = 0.0
-            
-            return result
+            # Fill in any required keys the classifier left out
+            return ORJSONResponse({"report_id": report_id, **_BASE_RESULT, **result})
         except Exception as ml_error:
-            print(f"ERROR in classify_report: {str(ml_error)}")
-            print(traceback.format_exc())
+            logger.exception("ERROR in classify_report: report_id=%s: %s", report_id, ml_error)
             # Return error response with 200 status (not 500) so frontend can handle it
-            return {
+            return ORJSONResponse({
                 "report_id": report_id,
                 "accept": False,
                 "status": "error",
                 "category": "Other",
                 "confidence": 0.0,
                 "reason": f"ML classification error: {str(ml_error)}"
-            }
+            })
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"ERROR in submit_report: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("ERROR in submit_report: %s", e)
         # Return error response with 200 status (not 500) so frontend can handle it
         error_report_id = report_id if 'report_id' in locals() else "unknown"
-        return {
+        return ORJSONResponse({
             "report_id": error_report_id,
             "accept": False,
             "status": "error",
             "category": "Other",
             "confidence": 0.0,
             "reason": f"ML processing error: {str(e)}"
-        }
+        })
+
+
+if __name__ == "__main__":
+    # python -m app.main: same settings as start.sh (see there for the
+    # WEB_CONCURRENCY trade-offs).
+    import uvicorn
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "7860")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        timeout_keep_alive=75,
+    )
@@ -1,11 +1,19 @@
-from pydantic import BaseModel, Field, field_validator
+import base64
+import binascii
+
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_validator, model_validator
 from typing import Optional
 
+# Frozen, whitespace-stripping config shared by the request/response models.
+_MODEL_CONFIG = ConfigDict(frozen=True, extra="ignore", str_strip_whitespace=True)
+
 class ReportRequest(BaseModel):
     """
     Pydantic model for JSON-based report submission.
     Accepts image as base64-encoded string instead of multipart/form-data.
     """
+    model_config = _MODEL_CONFIG
+    
     report_id: str = Field(..., min_length=1, description="Unique identifier for the report")
     description: str = Field(..., min_length=1, description="Description of the issue")
     user_id: Optional[str] = Field(None, description="Optional user identifier")
@@ -17,39 +25,56 @@ class ReportRequest(BaseModel):
     @classmethod
     def validate_not_empty(cls, v: str) -> str:
         """Ensure required fields are not empty strings"""
-        if not v or not v.strip():
+        if not v:
             raise ValueError('Field cannot be empty')
-        return v.strip()
+        return v
+    
+    _image_bytes: Optional[bytes] = PrivateAttr(default=None)
     
     @field_validator('image_base64')
     @classmethod
     def validate_image_base64(cls, v: Optional[str]) -> Optional[str]:
-        """Validate base64 image format"""
-        if v is None:
+        """Normalize empty image strings to None"""
+        if not v:
             return None
-        if not v.strip():
-            return None
-        
+        return v  # Return original with prefix if it had one
+    
+    @model_validator(mode='after')
+    def decode_image_base64(self):
+        """Decode the base64 image once; the bytes are kept for the pipeline"""
+        if self.image_base64 is None:
+            return self
+        image_data = self.image_base64
+
         # Remove data URI prefix if present (e.g., "data:image/jpeg;base64,")
-        image_data = v.strip()
-        if ',' in image_data:
-            image_data = image_data.split(',', 1)[1]
+        # Only the header is searched, not the whole multi-MB payload.
+        if image_data.startswith("data:"):
+            comma = image_data.find(",", 5)
+            if comma < 0:
+                raise ValueError('Invalid base64-encoded image data')
+            image_data = image_data[comma + 1:]
         
-        # Validate base64 format
-        import base64
+        # validate=True rejects non-alphabet characters; decoded only once
         try:
-            # Try to decode to verify it's valid base64
-            base64.b64decode(image_data, validate=True)
-            return v  # Return original with prefix if it had one
-        except Exception:
+            self._image_bytes = base64.b64decode(image_data, validate=True)
+        except (binascii.Error, ValueError):
             raise ValueError('Invalid base64-encoded image data')
+        if not self._image_bytes:
+            raise ValueError('Invalid base64-encoded image data')
+        return self
+    
+    @property
+    def image_bytes(self) -> Optional[bytes]:
+        """Decoded image bytes (None when no image was sent)"""
+        return self._image_bytes
 
-# Legacy models - kept for backward compatibility
 class ReportFormFields(BaseModel):
     """
-    DEPRECATED: Legacy model for form fields only.
-    Use ReportRequest instead for JSON-based requests.
+    Form fields of the multipart /submit endpoint (image is read separately).
+    Validated through a module-level TypeAdapter in app.main.
     """
+    model_config = _MODEL_CONFIG
+    
     report_id: str = Field(..., min_length=1, description="Unique identifier for the report")
     description: str = Field(..., min_length=1, description="Description of the issue")
     user_id: Optional[str] = Field(None, description="Optional user identifier")
@@ -60,12 +85,15 @@ class ReportFormFields(BaseModel):
     @classmethod
     def validate_not_empty(cls, v: str) -> str:
         """Ensure required fields are not empty strings"""
-        if not v or not v.strip():
+        if not v:
             raise ValueError('Field cannot be empty')
-        return v.strip()
+        return v
 
+# Legacy models - kept for backward compatibility
 class ReportIn(BaseModel):
     """DEPRECATED: Legacy model."""
+    model_config = _MODEL_CONFIG
+    
     report_id: str
     description: str
     user_id: Optional[str] = None
@@ -74,6 +102,8 @@ class ReportIn(BaseModel):
     longitude: Optional[float] = None
 
 class ReportStatus(BaseModel):
+    model_config = _MODEL_CONFIG
+    
     report_id: str
     accept: bool
     status: str
@@ -1,9 +1,16 @@
+import functools
+import logging
+import threading
+
+import imagehash
+
 from app import storage, dataset
 from app import image_classifier as ic
 from app.text_rules import (
     is_abusive,
     detect_category,
     detect_urgency,
+    normalize,
     CATEGORY_KEYWORDS
 )
 
@@ -13,6 +20,8 @@ import warnings
 
 warnings.filterwarnings("ignore", category=UserWarning, message=".*pkg_resources.*")
 
+logger = logging.getLogger(__name__)
+
 
 # ------------------------------------
 # Image → Category reference (COMPREHENSIVE)
@@ -84,15 +93,98 @@ GENERIC_IMAGE_LABELS = {
 # ------------------------------------
 # Model initialization
 # ------------------------------------
-def initialize_models():
-    """Initialize ML models (CLIP for image classification)"""
+def initialize_models(on_ready=None):
+    """Start loading ML models (CLIP for image classification) in the background.
+    Returns immediately; classification waits for the load, and `on_ready` is
+    called once it has finished."""
     try:
-        ic.initialize_clip()
+        ic.initialize_clip_in_background(on_done=on_ready)
     except Exception as e:
-        print(f"Model initialization failed (will use fallback): {str(e)}")
+        logger.warning("Model initialization failed (will use fallback): %s", e)
         pass
 
 
+def models_ready() -> bool:
+    """True once the CLIP model is loaded and usable."""
+    return ic.is_ready()
+
+
+def release_models():
+    """Release ML model weights (called on application shutdown)."""
+    ic.release_clip()
+
+
+# ------------------------------------
+# Non-blocking steps
+# ------------------------------------
+def _safe(stage, fallback=None):
+    """Decorator for pipeline steps that must never block a report: if the
+    step raises, log it (with traceback) and return `fallback` instead."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                logger.exception("%s failed (continuing)", stage)
+                return fallback
+        return wrapper
+    return decorate
+
+
+@_safe("Text duplicate check", fallback=False)
+def _is_duplicate_text(user_id, description, category):
+    return storage.is_duplicate(user_id, description, category, store=False)
+
+
+@_safe("Location duplicate check", fallback=False)
+def _is_duplicate_location(latitude, longitude, description, category):
+    # Same category within 10 meters
+    return storage.is_duplicate_location(latitude, longitude, description, category, threshold=10.0, store=False)
+
+
+@_safe("Duplicate image check", fallback=(False, None))
+def _is_duplicate_image(image):
+    """(is duplicate, pHash of the image)"""
+    img_hash = imagehash.phash(image)
+    return storage.is_duplicate_image_hash(img_hash, threshold=0), img_hash
+
+
+@_safe("Duplicate image check", fallback=False)
+def _is_duplicate_image_hash(img_hash):
+    return storage.is_duplicate_image_hash(img_hash, threshold=0)
+
+
+_DUPLICATE_TEXT = "You have already submitted this report."
+_DUPLICATE_LOCATION = "A similar issue has already been reported at this location."
+_DUPLICATE_IMAGE = "Duplicate image detected. This image has already been used in another report."
+
+
+def _duplicate_reason(user_id, description, category, latitude, longitude, img_hash):
+    """Rejection reason if the report duplicates an accepted one, else None."""
+    if _is_duplicate_text(user_id, description, category):
+        return _DUPLICATE_TEXT
+    if latitude is not None and longitude is not None:
+        if _is_duplicate_location(latitude, longitude, description, category):
+            return _DUPLICATE_LOCATION
+    if img_hash is not None and _is_duplicate_image_hash(img_hash):
+        return _DUPLICATE_IMAGE
+    return None
+
+
+# Held from the final duplicate check to the save of an accepted report.
+# Requests run on several ML_WORKERS threads and can all pass the early checks
+# for the same report; only the first to take this lock is accepted. CLIP and
+# the early checks run outside it.
+_accept_lock = threading.Lock()
+
+
+@_safe("Saving report to dataset")
+def _save_report(report, result):
+    dataset.save_report(_report_for_save(report, result))
+    logger.debug("Report %s queued for saving to dataset", result["status"])
+
+
 # ------------------------------------
 # Main pipeline (OPTIMIZED)
 # ------------------------------------
@@ -102,55 +194,66 @@ def classify_report(report: dict):
         if not description:
             return reject(report, "Description is required", confidence=0.0)
 
+        # Lowercased once for all the text rules below
+        text = normalize(description)
+
         # Category detection with confidence scoring
         try:
-            category, confidence = detect_category(description)
+            category, confidence = detect_category(text)
         except Exception as e:
-            print(f"[ERROR] Category detection failed: {str(e)}")
-            import traceback
-            print(traceback.format_exc())
+            logger.exception("Category detection failed: %s", e)
             return reject(report, f"Category detection error: {str(e)}", "Other", 0.0)
         
         # Reject if category is "Other" or confidence is below threshold
         if category == "Other" or confidence < CATEGORY_CONFIDENCE_THRESHOLD:
             return reject(report, "Unable to determine issue category. Please provide more details.", category, confidence)
 
-        if is_abusive(description):
+        if is_abusive(text):
             return reject(report, "Abusive language detected", category, confidence)
 
         # Check for same user duplicate (same user, same description, same category)
         user_id = report.get("user_id", "anon")
-        try:
-            if storage.is_duplicate(user_id, description, category, store=False):
-                return reject(report, "You have already submitted this report.", category, confidence)
-        except Exception as e:
-            print(f"[ERROR] Text duplicate check failed: {str(e)}")
-            # Continue - don't block on technical errors
+        if _is_duplicate_text(user_id, description, category):
+            return reject(report, _DUPLICATE_TEXT, category, confidence)
 
         # Check for location-based duplicate (same category within 10 meters)
         latitude = report.get("latitude")
         longitude = report.get("longitude")
         if latitude is not None and longitude is not None:
-            try:
-                if storage.is_duplicate_location(latitude, longitude, description, category, threshold=10.0, store=False):
-                    return reject(report, "A similar issue has already been reported at this location.", category, confidence)
-            except Exception as e:
-                print(f"[ERROR] Location duplicate check failed: {str(e)}")
-                # Continue - don't block on technical errors
+            if _is_duplicate_location(latitude, longitude, description, category):
+                return reject(report, _DUPLICATE_LOCATION, category, confidence)
 
-        # STEP 1: Check image against detected category FIRST (BEFORE duplicate check)
+        # Image checks: the exact-duplicate pHash lookup runs before CLIP, so
+        # a reused image is rejected without a model forward pass
         image_bytes = report.get("image_bytes")  # Changed from image_url to image_bytes
+        image = img_hash = None
         if image_bytes:
-            print(f"[DEBUG] Processing image for category '{category}' (image size: {len(image_bytes)} bytes)")
+            logger.debug("Processing image for category '%s' (image size: %s bytes)", category, len(image_bytes))
             
+            # Decode once: CLIP (on an embedding cache miss), the duplicate
+            # check and the stored image hash all use this RGB image.
             try:
-                # CRITICAL: Validate image matches category FIRST
-                # If image doesn't match, reject immediately - don't check duplicates
-                image_matches = image_matches_category_from_bytes(image_bytes, category)
+                image = ic.open_image(image_bytes).convert('RGB')
+            except Exception as e:
+                logger.warning("Could not decode image: %s", e)
+            
+            try:
+                # STEP 1: Duplicate image check (threshold=0: EXACT match only - most strict)
+                logger.debug("Checking for duplicate image")
+                is_dup = False
+                if image is not None:
+                    is_dup, img_hash = _is_duplicate_image(image)
+                
+                if is_dup:
+                    logger.debug("DUPLICATE DETECTED")
+                    return reject(report, _DUPLICATE_IMAGE, category, confidence)
+                
+                # STEP 2: Validate image matches category (runs CLIP)
+                image_matches = image_matches_category_from_bytes(image_bytes, category, image=image)
                 
                 if not image_matches:
-                    # Image doesn't match category - reject immediately
-                    print(f"[DEBUG] Image does NOT match category '{category}' - rejecting without duplicate check")
+                    # Image doesn't match category - reject
+                    logger.debug("Image does NOT match category '%s' - rejecting", category)
                     return reject(
                         report,
                         "Image does not match the issue description. Please provide an image related to the reported category.",
@@ -158,34 +261,14 @@ def classify_report(report: dict):
                         confidence
                     )
                 
-                print(f"[DEBUG] Image matches category '{category}' - proceeding to duplicate check")
-                
-                # STEP 2: Only check for duplicates if image matches category
-                try:
-                    # Check for duplicates with threshold=0 (EXACT match only - most strict)
-                    print(f"[DEBUG] Checking for duplicate image")
-                    is_dup = storage.is_duplicate_image_from_bytes(image_bytes, threshold=0, store=False)
-                    
-                    if is_dup:
-                        print(f"[DEBUG] DUPLICATE DETECTED")
-                        return reject(report, "Duplicate image detected. This image has already been used in another report.", category, confidence)
-                    
-                    print(f"[DEBUG] Image is NOT duplicate - will be stored in dataset after acceptance")
-                    # Image hash will be stored in dataset when report is saved
-                except Exception as e:
-                    # If duplicate check fails, allow submission (don't block on technical errors)
-                    print(f"[ERROR] Duplicate check failed (allowing submission): {str(e)}")
-                    import traceback
-                    print(traceback.format_exc())
-                    # Continue - don't block legitimate reports due to technical issues
+                logger.debug("Image matches category '%s' and is NOT duplicate - will be stored in dataset after acceptance", category)
+                # Image hash will be stored in dataset when report is saved
             except Exception as e:
-                print(f"[ERROR] Image validation failed: {str(e)}")
-                import traceback
-                print(traceback.format_exc())
+                logger.exception("Image validation failed: %s", e)
                 # If image validation fails, reject the report
                 return reject(report, f"Image validation error: {str(e)}", category, confidence)
 
-        urgency = detect_urgency(description)
+        urgency = detect_urgency(text)
         
         # Prepare result with all necessary data for duplicate checking
         result = {
@@ -203,141 +286,169 @@ def classify_report(report: dict):
             "longitude": longitude
         }
         
-        # Compute and store image hash if image is provided
-        image_bytes = report.get("image_bytes")
-        if image_bytes:
+        # Store image hash if image is provided (computed during the duplicate check)
+        if image is not None:
             try:
-                from PIL import Image
-                import imagehash
-                import io
-                img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-                img_hash = imagehash.phash(img)
+                if img_hash is None:
+                    img_hash = imagehash.phash(image)
                 result["image_hash"] = str(img_hash)  # Store as string for JSON serialization
             except Exception as e:
-                print(f"[WARNING] Failed to compute image hash (non-critical): {str(e)}")
+                logger.warning("Failed to compute image hash (non-critical): %s", e)
                 # Continue without image hash
 
-        # Save to dataset (this is how we "store" for future duplicate checks)
-        # Remove image_bytes from report data before saving (can't serialize bytes to JSON)
-        report_for_save = {**report, **result}
-        if "image_bytes" in report_for_save:
-            # Remove image_bytes - we only need image_hash for duplicate checking
-            del report_for_save["image_bytes"]
-        
-        try:
-            dataset.save_report(report_for_save)
-            print(f"[DEBUG] Successfully saved accepted report to dataset")
-        except Exception as e:
-            print(f"[ERROR] Failed to save report to dataset (non-critical): {str(e)}")
-            import traceback
-            print(traceback.format_exc())
-            # Continue - dataset save failure shouldn't block acceptance
-        
+        with _accept_lock:
+            # Re-check under the lock: a concurrent request may have accepted
+            # the same report since the checks above
+            reason = _duplicate_reason(user_id, description, category, latitude, longitude, img_hash)
+            if reason is not None:
+                return reject(report, reason, category, confidence)
+            # Save to dataset (this is how we "store" for future duplicate checks)
+            _save_report(report, result)
         return result
 
     except Exception as e:
-        print(f"[ERROR] Critical error in classify_report: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Critical error in classify_report: %s", e)
         return reject(report, f"Processing error: {str(e)}", confidence=0.0)
 
 
+# Lowercased allowed labels / keywords per category, built once at import
+_ALLOWED_LABELS = {cat: tuple(lbl.lower() for lbl in labels) for cat, labels in IMAGE_TO_CATEGORY_MAP.items()}
+_CATEGORY_KEYWORDS_LOWER = {cat: tuple(kw.lower() for kw in kws) for cat, kws in CATEGORY_KEYWORDS.items()}
+_ALLOWED_LABEL_SET = {cat: frozenset(labels) for cat, labels in _ALLOWED_LABELS.items()}
+# Union of the words of all allowed labels: a label shares a word with some
+# allowed label iff it shares one with this set.
+_ALLOWED_LABEL_WORDS = {cat: frozenset(w for lbl in labels for w in lbl.split()) for cat, labels in _ALLOWED_LABELS.items()}
+# Categories an image can be validated against at all
+_CATEGORIES_WITH_RULES = frozenset(
+    cat for cat in set(_ALLOWED_LABELS) | set(_CATEGORY_KEYWORDS_LOWER)
+    if _ALLOWED_LABELS.get(cat) or _CATEGORY_KEYWORDS_LOWER.get(cat)
+)
+
+
+def _label_matches_category(image_label: str, category: str) -> bool:
+    """Matching rules between a (lowercased) image label and a category."""
+    # Get allowed labels and keywords for this category
+    allowed_labels = _ALLOWED_LABELS.get(category, ())
+    category_keywords = _CATEGORY_KEYWORDS_LOWER.get(category, ())
+
+    # If no validation rules for this category, allow through (can't validate)
+    if not allowed_labels and not category_keywords:
+        return True
+
+    # Method 1: Direct exact match with allowed labels
+    if image_label in _ALLOWED_LABEL_SET.get(category, ()):
+        return True
+
+    # Method 2: Check if image label contains any allowed label (substring match)
+    if any(lbl in image_label or image_label in lbl for lbl in allowed_labels):
+        return True
+
+    # Method 3: Check if image label contains any category keyword from description
+    if any(kw in image_label or image_label in kw for kw in category_keywords):
+        return True
+
+    # Method 4: Word-level matching (split and check for common words)
+    image_words = set(image_label.split())
+    if not image_words.isdisjoint(_ALLOWED_LABEL_WORDS.get(category, ())):
+        return True
+
+    # Method 5: Check if any word from image appears in category keywords
+    for word in image_words:
+        if len(word) > 2:  # Only check meaningful words (length > 2)
+            if any(word in kw or kw in word for kw in category_keywords):
+                return True
+            if any(word in lbl or lbl in word for lbl in allowed_labels):
+                return True
+
+    # None of the methods match and we have validation rules: reject
+    return False
+
+
+# Verdict of the rules above for every label CLIP can return, per category,
+# computed once instead of re-running the string matching on each request.
+_CLIP_VOCABULARY = frozenset(lbl.lower().strip() for lbl in ic.DEFAULT_LABELS)
+_IMAGE_LABEL_VERDICTS = {
+    category: frozenset(lbl for lbl in _CLIP_VOCABULARY if _label_matches_category(lbl, category))
+    for category in set(IMAGE_TO_CATEGORY_MAP) | set(CATEGORY_KEYWORDS)
+}
+
+
 # ------------------------------------
 # Image validation logic (BALANCED) - FROM BYTES
 # ------------------------------------
-def image_matches_category_from_bytes(image_bytes: bytes, category: str) -> bool:
+def image_matches_category_from_bytes(image_bytes: bytes, category: str, image=None) -> bool:
     """
     Check if image matches the detected category.
-    Works with image bytes directly (no URL required).
+    Works with image bytes directly (no URL required); `image` is the already
+    decoded RGB image, if the caller has one.
     Returns True if image matches or if classification is uncertain (allow through).
     Returns False ONLY if we can confidently determine the image doesn't match.
     """
+    # If no validation rules for this category, allow through without running CLIP
+    if category not in _CATEGORIES_WITH_RULES:
+        logger.debug("No validation rules for category '%s' - allowing through", category)
+        return True
+
     try:
-        image_label = ic.classify_image_from_bytes(image_bytes)
+        # A background model load may still be running; don't wait on it forever
+        if not ic.wait_until_ready(ic.CLIP_READY_TIMEOUT):
+            logger.warning("CLIP still loading after %ss - allowing image through (unchecked)", ic.CLIP_READY_TIMEOUT)
+            return True  # Allow through, as when classification is unavailable
+        image_label = ic.classify_image_from_bytes(image_bytes, image=image)
         image_label = str(image_label).lower().strip() if image_label else "other"
         
-        print(f"[DEBUG] Image classified as: '{image_label}' for category '{category}'")
+        logger.debug("Image classified as: '%s' for category '%s'", image_label, category)
         
         # If classifier completely fails or returns empty, allow through (uncertain)
         if not image_label or image_label == "":
-            print(f"[DEBUG] Image classification returned empty - allowing through (uncertain)")
+            logger.debug("Image classification returned empty - allowing through (uncertain)")
             return True  # Allow through if classification fails
         
-        # Get allowed labels and keywords for this category
-        allowed_labels = [lbl.lower() for lbl in IMAGE_TO_CATEGORY_MAP.get(category, [])]
-        category_keywords = [kw.lower() for kw in CATEGORY_KEYWORDS.get(category, [])]
-
         # If "other" - classification uncertain, allow through (don't reject uncertain cases)
         if image_label == "other":
-            print(f"[DEBUG] Image classified as 'other' - allowing through (uncertain classification)")
+            logger.debug("Image classified as 'other' - allowing through (uncertain classification)")
             return True  # Allow through - don't reject uncertain classifications
 
         # If generic label, allow through (too vague to confidently reject)
         if image_label in GENERIC_IMAGE_LABELS:
-            print(f"[DEBUG] Image classified as generic '{image_label}' - allowing through (uncertain)")
+            logger.debug("Image classified as generic '%s' - allowing through (uncertain)", image_label)
             return True  # Allow through - generic labels are too vague to reject
 
-        # Method 1: Direct exact match with allowed labels
-        if image_label in allowed_labels:
-            print(f"Image label '{image_label}' exactly matches category '{category}' - accepting")
-            return True
+        # CLIP labels come from a closed vocabulary, so the verdict is a table
+        # lookup; anything else goes through the matching rules directly.
+        verdicts = _IMAGE_LABEL_VERDICTS.get(category)
+        if verdicts is not None and image_label in _CLIP_VOCABULARY:
+            matches = image_label in verdicts
+        else:
+            matches = _label_matches_category(image_label, category)
 
-        # Method 2: Check if image label contains any allowed label (substring match)
-        for lbl in allowed_labels:
-            if lbl in image_label or image_label in lbl:
-                print(f"Image label '{image_label}' contains allowed label '{lbl}' for category '{category}' - accepting")
-                return True
-
-        # Method 3: Check if image label contains any category keyword from description
-        for kw in category_keywords:
-            if kw in image_label or image_label in kw:
-                print(f"Image label '{image_label}' matches keyword '{kw}' for category '{category}' - accepting")
-                return True
-
-        # Method 4: Word-level matching (split and check for common words)
-        image_words = set(image_label.split())
-        for lbl in allowed_labels:
-            lbl_words = set(lbl.split())
-            common_words = image_words.intersection(lbl_words)
-            if common_words and len(common_words) > 0:
-                print(f"Image label '{image_label}' shares words with '{lbl}' for category '{category}' - accepting")
-                return True
-
-        # Method 5: Check if any word from image appears in category keywords
-        for word in image_words:
-            if len(word) > 2:  # Only check meaningful words (length > 2)
-                for kw in category_keywords:
-                    if word in kw or kw in word:
-                        print(f"Image word '{word}' matches keyword '{kw}' for category '{category}' - accepting")
-                        return True
-                for lbl in allowed_labels:
-                    if word in lbl or lbl in word:
-                        print(f"Image word '{word}' matches label '{lbl}' for category '{category}' - accepting")
-                        return True
-
-        # If no validation rules for this category, allow through (can't validate)
-        if not allowed_labels and not category_keywords:
-            print(f"[DEBUG] No validation rules for category '{category}' - allowing through")
-            return True  # Allow through if we can't validate
-
-        # If none of the methods match and we have validation rules, reject
-        # Only reject if we have clear validation rules and can confidently say it doesn't match
-        if allowed_labels or category_keywords:
-            print(f"[DEBUG] Image label '{image_label}' does NOT match category '{category}' - rejecting")
-            return False  # Reject only if we have validation rules and it clearly doesn't match
-
-        # If no validation rules, allow through
-        print(f"[DEBUG] No clear match but no validation rules - allowing through")
-        return True
+        if matches:
+            logger.debug("Image label '%s' matches category '%s' - accepting", image_label, category)
+        else:
+            logger.debug("Image label '%s' does NOT match category '%s' - rejecting", image_label, category)
+        return matches
 
     except Exception as e:
         # If classification fails completely, allow through (don't block on technical errors)
-        print(f"[DEBUG] Image classification error for category '{category}' - allowing through (technical error): {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.warning("Image classification error for category '%s' - allowing through (technical error): %s", category, e, exc_info=True)
         return True  # Allow through if classification fails (technical error)
 
 
+# ------------------------------------
+# Dataset record
+# ------------------------------------
+# Report fields kept in dataset.jsonl. image_bytes is deliberately absent: it
+# can't be serialized, and duplicate checks only need the stored image_hash.
+_SAVED_KEYS = ("report_id", "description", "user_id", "latitude", "longitude", "category", "image_url")
+
+
+def _report_for_save(report, result):
+    """The dataset record for a report: its saved fields plus the result."""
+    report_for_save = {key: report[key] for key in _SAVED_KEYS if key in report}
+    report_for_save.update(result)
+    return report_for_save
+
+
 # ------------------------------------
 # Reject helper
 # ------------------------------------
@@ -350,18 +461,5 @@ def reject(report, reason, category="Other", confidence=0.0):
         "confidence": round(confidence, 2),  # Include confidence in rejection
         "reason": reason
     }
-    # Remove image_bytes from report data before saving (can't serialize bytes to JSON)
-    report_for_save = {**report, **result}
-    if "image_bytes" in report_for_save:
-        # Remove image_bytes - we only need image_hash for duplicate checking
-        del report_for_save["image_bytes"]
-    
-    try:
-        dataset.save_report(report_for_save)
-        print(f"[DEBUG] Successfully saved rejected report to dataset")
-    except Exception as e:
-        print(f"[ERROR] Failed to save rejected report to dataset (non-critical): {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        # Continue - dataset save failure shouldn't block rejection response
+    _save_report(report, result)
     return result
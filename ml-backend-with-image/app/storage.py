@@ -1,38 +1,180 @@
-from PIL import Image
 import imagehash
-import requests
-import io
-import json
+import logging
+import math
+import numpy as np
+import orjson
+import threading
+from urllib.parse import urlparse, urlunparse
 from pathlib import Path
 from math import radians, cos, sin, asin, sqrt
 
 # Import dataset module to access the dataset file
 from app import dataset
+from app.image_classifier import fetch_image, open_image
 
-def _load_accepted_reports():
-    """Load all accepted reports from dataset.jsonl."""
-    try:
-        if not dataset.DATA_FILE.exists():
-            return []
-        
-        accepted_reports = []
-        with dataset.DATA_FILE.open("r", encoding="utf8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
+logger = logging.getLogger(__name__)
+
+# Location index: (category, lat cell, lon cell) -> [(lat, lon), ...]
+_GRID_DEG = 0.001  # ~111m of latitude per cell
+_EARTH_RADIUS_M = 6371000  # same radius as haversine()
+_MAX_GRID_CELLS = 400  # larger search boxes fall back to a linear scan
+
+
+_LON_CELLS = round(360 / _GRID_DEG)
+
+
+def _grid_cell(lat: float, lon: float):
+    # Longitude cells wrap around so the antimeridian needs no special case
+    return math.floor(lat / _GRID_DEG), math.floor(lon / _GRID_DEG) % _LON_CELLS
+
+
+def _normalize_url(url: str) -> str:
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
+
+
+def _fast_lower(s: str) -> str:
+    # islower() is a single early-exit scan; skip allocating a copy when the
+    # text is already lowercase (the common case for descriptions)
+    return s if s.islower() else s.lower()
+
+
+def _text_key(user_id, description, category):
+    """Identity of a report for the exact text duplicate check."""
+    return (_fast_lower(user_id or "anon"),
+            " ".join(_fast_lower((description or "").strip()).split()),
+            _fast_lower(category or ""))
+
+
+class _AcceptedIndex:
+    """In-memory view of the ACCEPTED reports in dataset.jsonl: only the
+    (already normalized) keys the duplicate checks look up, not the reports.
+
+    dataset.jsonl is append-only, so refresh() only parses the lines added
+    since the last call; the whole file is re-read only if it was replaced,
+    truncated or rewritten in place.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._file_id = None
+        self._offset = 0  # bytes parsed so far (always at a line boundary)
+        self._mtime_ns = None
+        self.text_keys = set()
+        self.image_urls = set()
+        self.image_hash_set = set()
+        self._image_hash_list = []
+        self._image_hash_array = np.empty(0, dtype=np.uint64)
+        self.grid = {}
+
+    def refresh(self):
+        dataset.flush()  # include reports still queued for writing
+        with self._lock:
+            try:
+                st = dataset.DATA_FILE.stat()
+            except OSError:
+                self._reset()
+                return self
+            file_id = (st.st_dev, st.st_ino)
+            if (file_id != self._file_id or st.st_size < self._offset
+                    or (st.st_size == self._offset and st.st_mtime_ns != self._mtime_ns)):
+                self._reset()
+                self._file_id = file_id
+            if st.st_size > self._offset:
+                self._read_tail()
+            self._mtime_ns = st.st_mtime_ns
+            return self
+
+    def _read_tail(self):
+        try:
+            with dataset.DATA_FILE.open("rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError as e:
+            logger.error("Failed to load accepted reports from dataset: %s", e)
+            return
+        end = data.rfind(b"\n") + 1  # a partially written last line waits for the next refresh
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                report = orjson.loads(line)
+            except ValueError:
+                continue  # Skip invalid JSON lines
+            # Only include accepted reports
+            if isinstance(report, dict) and report.get("status") == "accepted" and report.get("accept") is True:
                 try:
-                    report = json.loads(line)
-                    # Only include accepted reports
-                    if report.get("status") == "accepted" and report.get("accept") is True:
-                        accepted_reports.append(report)
-                except json.JSONDecodeError:
-                    continue  # Skip invalid JSON lines
-        
-        return accepted_reports
-    except Exception as e:
-        print(f"[ERROR] Failed to load accepted reports from dataset: {str(e)}")
-        return []
+                    self._add(report)
+                except Exception as e:
+                    # One malformed record must not stall the offset (and with
+                    # it every later refresh); skip it like an invalid line
+                    logger.warning("Skipping malformed accepted report %s: %s", report.get("report_id"), e)
+        self._offset += end
+
+    def _add(self, report):
+        self.text_keys.add(_text_key(report.get("user_id"), report.get("description"), report.get("category")))
+
+        report_image_url = report.get("image_url")
+        if report_image_url:
+            try:
+                self.image_urls.add(_normalize_url(report_image_url))
+            except Exception:
+                pass
+
+        report_hash = report.get("image_hash")
+        if report_hash is not None:
+            try:
+                report_hash_int = int(report_hash, 16) if isinstance(report_hash, str) else int(report_hash)
+            except (ValueError, TypeError):
+                report_hash_int = None  # Skip invalid hash values
+            if (report_hash_int is not None and 0 <= report_hash_int < 1 << 64
+                    and report_hash_int not in self.image_hash_set):
+                self.image_hash_set.add(report_hash_int)
+                self._image_hash_list.append(report_hash_int)
+
+        try:
+            lat = float(report["latitude"])
+            lon = float(report["longitude"])
+        except (KeyError, TypeError, ValueError):
+            return  # no usable location
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            return  # "nan"/"inf" parse as floats but can't be bucketed (or be near anything)
+        category = (report.get("category") or "").lower()
+        # Radians and cos(lat) are kept with each point so distance checks
+        # don't redo the conversion for every stored report
+        lat_rad, lon_rad = radians(lat), radians(lon)
+        self.grid.setdefault((category,) + _grid_cell(lat, lon), []).append(
+            (lat, lon, lat_rad, lon_rad, cos(lat_rad))
+        )
+
+    @property
+    def image_hashes(self):
+        """All stored 64-bit image hashes as one np.uint64 array."""
+        with self._lock:
+            if self._image_hash_array.size != len(self._image_hash_list):
+                self._image_hash_array = np.array(self._image_hash_list, dtype=np.uint64)
+            return self._image_hash_array
+
+
+_index = _AcceptedIndex()
+
+
+def _accepted_snapshot():
+    """The accepted-reports index, brought up to date with dataset.jsonl."""
+    return _index.refresh()
+
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:  # numpy < 2.0: count bits one byte at a time
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
 
 
 def is_duplicate(user_id: str, description: str, category: str, store: bool = True) -> bool:
@@ -44,32 +186,14 @@ def is_duplicate(user_id: str, description: str, category: str, store: bool = Tr
     Note: store parameter is kept for compatibility but doesn't do anything (data is stored via dataset.save_report).
     """
     try:
-        # Normalize the description - remove extra whitespace
-        normalized_desc = " ".join(description.strip().lower().split())
-        user_id_normalized = (user_id or "anon").lower()
-        category_normalized = category.lower()
-        
-        # Load all accepted reports from dataset
-        accepted_reports = _load_accepted_reports()
-        
-        # Check each accepted report
-        for report in accepted_reports:
-            report_user_id = (report.get("user_id") or "anon").lower()
-            report_desc = " ".join((report.get("description") or "").strip().lower().split())
-            report_category = (report.get("category") or "").lower()
-            
-            # Check for exact match
-            if (report_user_id == user_id_normalized and 
-                report_desc == normalized_desc and 
-                report_category == category_normalized):
-                print(f"[DEBUG] Text duplicate found in dataset: user_id={user_id_normalized}, category={category}")
-                return True
+        key = _text_key(user_id, description, category)
+        if key in _accepted_snapshot().text_keys:
+            logger.debug("Text duplicate found in dataset: user_id=%s, category=%s", key[0], category)
+            return True
         
         return False
     except Exception as e:
-        print(f"[ERROR] Text duplicate check failed: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Text duplicate check failed: %s", e)
         return False  # On error, don't block submission
 
 def is_duplicate_image(image_url: str, threshold: int = 0, store: bool = True) -> bool:
@@ -87,63 +211,74 @@ def is_duplicate_image(image_url: str, threshold: int = 0, store: bool = True) -
     try:
         # Step 1: Quick URL-based check (exact match) - check dataset for image URLs
         try:
-            from urllib.parse import urlparse, urlunparse
-            parsed = urlparse(image_url)
-            normalized_url = urlunparse((parsed.scheme, parsed.netloc, parsed.path, '', '', ''))
-            
-            # Load accepted reports and check for URL match
-            accepted_reports = _load_accepted_reports()
-            for report in accepted_reports:
-                # Check if report has image_url stored
-                report_image_url = report.get("image_url")
-                if report_image_url:
-                    try:
-                        report_parsed = urlparse(report_image_url)
-                        report_normalized = urlunparse((report_parsed.scheme, report_parsed.netloc, report_parsed.path, '', '', ''))
-                        if report_normalized == normalized_url:
-                            print(f"[DEBUG] Duplicate detected: Exact URL match in dataset for {normalized_url}")
-                            return True
-                    except Exception:
-                        continue
+            normalized_url = _normalize_url(image_url)
+            if normalized_url in _accepted_snapshot().image_urls:
+                logger.debug("Duplicate detected: Exact URL match in dataset for %s", normalized_url)
+                return True
         except Exception as e:
-            print(f"[WARNING] URL normalization failed: {str(e)}")
+            logger.warning("URL normalization failed: %s", e)
             # Continue with hash check
         
-        # Step 2: Hash-based check (only for exact matches with threshold=0)
+        # Step 2: Hash-based check (Hamming distance <= threshold)
         try:
-            resp = requests.get(image_url, timeout=10)
-            resp.raise_for_status()
-            img = Image.open(io.BytesIO(resp.content)).convert('RGB')
-            img_hash = imagehash.phash(img)
-            img_hash_int = int(str(img_hash), 16)
-
-            # Load accepted reports and check for hash match
-            accepted_reports = _load_accepted_reports()
-            for report in accepted_reports:
-                report_hash = report.get("image_hash")
-                if report_hash is not None:
-                    try:
-                        if isinstance(report_hash, str):
-                            report_hash_int = int(report_hash, 16)
-                        else:
-                            report_hash_int = int(report_hash)
-                        
-                        if abs(img_hash_int - report_hash_int) == 0:
-                            print(f"[DEBUG] Duplicate detected: Exact hash match in dataset")
-                            return True
-                    except (ValueError, TypeError):
-                        continue
-            
-            return False
+            img = fetch_image(image_url, timeout=10)
+            return is_duplicate_image_hash(imagehash.phash(img), threshold)
         except Exception as e:
             # On any failure to fetch/process image, treat as non-duplicate
-            print(f"[ERROR] Image hash check failed for {image_url}: {str(e)}")
+            logger.error("Image hash check failed for %s: %s", image_url, e)
+            return False
+    except Exception as e:
+        logger.error("Image duplicate check failed: %s", e)
+        return False
+
+
+def _hash_int(img_hash) -> int:
+    """Integer value of an imagehash.ImageHash (bits read straight from its bool
+    array, without the hex round trip) or of a hex string."""
+    bits = getattr(img_hash, "hash", None)
+    if bits is not None:
+        return int.from_bytes(np.packbits(np.asarray(bits, dtype=bool).ravel()).tobytes(), "big")
+    return int(str(img_hash), 16)
+
+
+def is_duplicate_image_hash(img_hash, threshold: int = 0) -> bool:
+    """Check a precomputed perceptual hash (imagehash.ImageHash or hex string)
+    against the image hashes of ACCEPTED reports in dataset.jsonl.
+    threshold = maximum Hamming distance allowed to consider images equal.
+    threshold=0 means EXACT hash match only (most strict).
+    """
+    try:
+        img_hash_int = _hash_int(img_hash)
+        if not 0 <= img_hash_int < 1 << 64:
+            return False  # not a 64-bit pHash, nothing stored to compare with
+
+        snapshot = _accepted_snapshot()
+        if threshold <= 0:
+            # Exact match: a set lookup, no distance computation needed
+            if img_hash_int in snapshot.image_hash_set:
+                logger.debug("Image duplicate detected: Exact hash match in dataset")
+                return True
             return False
+
+        # Hamming distance against every stored hash in one vectorized pass
+        stored_hashes = snapshot.image_hashes
+        if stored_hashes.size:
+            distances = _popcount(stored_hashes ^ np.uint64(img_hash_int))
+            if (distances <= threshold).any():
+                logger.debug("Image duplicate detected: hash within Hamming distance %s in dataset", threshold)
+                return True
+        
+        return False
     except Exception as e:
-        print(f"[ERROR] Image duplicate check failed: {str(e)}")
+        logger.error("Image hash check failed: %s", e)
         return False
 
 
+def is_duplicate_image_from_pil(img, threshold: int = 0) -> bool:
+    """Same as is_duplicate_image_from_bytes for an already decoded RGB image."""
+    return is_duplicate_image_hash(imagehash.phash(img), threshold)
+
+
 def is_duplicate_image_from_bytes(image_bytes: bytes, threshold: int = 0, store: bool = True) -> bool:
     """Check if an image is a duplicate using perceptual hash (pHash) from bytes.
     Works with image bytes directly (no URL required).
@@ -158,39 +293,12 @@ def is_duplicate_image_from_bytes(image_bytes: bytes, threshold: int = 0, store:
     
     try:
         # Open image directly from bytes and compute hash
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        img_hash = imagehash.phash(img)
-        img_hash_int = int(str(img_hash), 16)  # Convert to integer for comparison
-
-        # Load all accepted reports from dataset
-        accepted_reports = _load_accepted_reports()
-        
-        # Check each accepted report for image hash
-        for report in accepted_reports:
-            # Check if report has image_hash stored
-            report_hash = report.get("image_hash")
-            if report_hash is not None:
-                try:
-                    # Compare hashes (exact match for threshold=0)
-                    if isinstance(report_hash, str):
-                        report_hash_int = int(report_hash, 16)
-                    else:
-                        report_hash_int = int(report_hash)
-                    
-                    # With threshold=0, only exact hash matches are duplicates
-                    if abs(img_hash_int - report_hash_int) == 0:
-                        print(f"[DEBUG] Image duplicate detected: Exact hash match in dataset")
-                        return True
-                except (ValueError, TypeError):
-                    continue  # Skip invalid hash values
-        
-        return False
+        img = open_image(image_bytes).convert('RGB')
+        return is_duplicate_image_from_pil(img, threshold)
     except Exception as e:
         # On any failure to process image, treat as non-duplicate
         # Log the error for debugging but don't block submission
-        print(f"[ERROR] Image hash check failed: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Image hash check failed: %s", e)
         return False
 
 def haversine(lat1, lon1, lat2, lon2):
@@ -203,6 +311,48 @@ def haversine(lat1, lon1, lat2, lon2):
     r = 6371000  # Earth radius in meters
     return c * r
 
+# Below this many candidates the scalar haversine loop beats numpy's per-call overhead
+_VECTORIZE_MIN_CANDIDATES = 32
+
+
+def _haversine_prepared(lat1, lon1, cos_lat1, lat2, lon2, cos_lat2):
+    """haversine() for points already in radians, with cos(lat) precomputed."""
+    a = sin((lat2 - lat1)/2)**2 + cos_lat1 * cos_lat2 * sin((lon2 - lon1)/2)**2
+    return 2 * asin(sqrt(a)) * 6371000
+
+
+def _haversine_many(lat1, lon1, cos_lat1, points):
+    """_haversine_prepared() to each row of an (N, 5) array of grid points."""
+    lat2, lon2, cos_lat2 = points[:, 2], points[:, 3], points[:, 4]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(a)) * 6371000
+
+
+def _location_candidates(snapshot, lat: float, lon: float, category: str, threshold: float):
+    """Stored locations of `category` that can be within `threshold` meters:
+    the grid cells overlapping the search box, or everything when the box is
+    too large."""
+    grid = snapshot.grid
+    # Bounding box of the search circle (exact for great-circle distance)
+    angle = threshold / _EARTH_RADIUS_M
+    dlat = math.degrees(angle)
+    cos_lat = math.cos(math.radians(lat))
+    if math.sin(angle) < cos_lat:
+        dlon = math.degrees(math.asin(math.sin(angle) / cos_lat))
+    else:
+        dlon = 360.0  # circle contains a pole
+    lat_lo, lat_hi = math.floor((lat - dlat) / _GRID_DEG), math.floor((lat + dlat) / _GRID_DEG)
+    lon_lo, lon_hi = math.floor((lon - dlon) / _GRID_DEG), math.floor((lon + dlon) / _GRID_DEG)
+    if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > _MAX_GRID_CELLS:
+        for (cell_category, _, _), points in list(grid.items()):
+            if cell_category == category:
+                yield from points
+        return
+    for i in range(lat_lo, lat_hi + 1):
+        for j in range(lon_lo, lon_hi + 1):
+            yield from grid.get((category, i, j % _LON_CELLS), ())
+
+
 def is_duplicate_location(lat: float, lon: float, description: str, category: str, threshold: float = 10.0, store: bool = True) -> bool:
     """
     Return True if an existing ACCEPTED report with same category exists within threshold meters.
@@ -212,33 +362,34 @@ def is_duplicate_location(lat: float, lon: float, description: str, category: st
     Note: store parameter is kept for compatibility but doesn't do anything (location is stored via dataset.save_report).
     """
     try:
-        # Load all accepted reports from dataset
-        accepted_reports = _load_accepted_reports()
-        
         category_normalized = category.lower()
+        snapshot = _accepted_snapshot()
         
-        # Check each accepted report
-        for report in accepted_reports:
-            report_category = (report.get("category") or "").lower()
-            
-            # Check for same category
-            if report_category == category_normalized:
-                # Get location from report
-                report_lat = report.get("latitude")
-                report_lon = report.get("longitude")
-                
-                if report_lat is not None and report_lon is not None:
-                    # Calculate distance
-                    dist = haversine(lat, lon, float(report_lat), float(report_lon))
-                    # Consider duplicate if same category within threshold meters
-                    if dist <= threshold:
-                        print(f"[DEBUG] Location duplicate found in dataset: ({lat}, {lon}) is {dist:.2f}m from ({report_lat}, {report_lon}) for category '{category}'")
-                        return True
+        candidates = list(_location_candidates(snapshot, lat, lon, category_normalized, threshold))
+        # Convert the query point once, not per candidate
+        lat_rad, lon_rad = radians(lat), radians(lon)
+        cos_lat = cos(lat_rad)
+        if len(candidates) > _VECTORIZE_MIN_CANDIDATES:
+            # Many candidates (large threshold): one vectorized haversine pass
+            points = np.array(candidates, dtype=np.float64)
+            distances = _haversine_many(lat_rad, lon_rad, cos_lat, points)
+            hits = np.flatnonzero(distances <= threshold)
+            if hits.size:
+                (report_lat, report_lon, *_), dist = candidates[hits[0]], distances[hits[0]]
+                logger.debug("Location duplicate found in dataset: (%s, %s) is %.2fm from (%s, %s) for category '%s'", lat, lon, dist, report_lat, report_lon, category)
+                return True
+            return False
+
+        for report_lat, report_lon, report_lat_rad, report_lon_rad, report_cos_lat in candidates:
+            # Calculate distance
+            dist = _haversine_prepared(lat_rad, lon_rad, cos_lat, report_lat_rad, report_lon_rad, report_cos_lat)
+            # Consider duplicate if same category within threshold meters
+            if dist <= threshold:
+                logger.debug("Location duplicate found in dataset: (%s, %s) is %.2fm from (%s, %s) for category '%s'", lat, lon, dist, report_lat, report_lon, category)
+                return True
         
         return False
     except Exception as e:
         # On error, don't block submission - be permissive
-        print(f"[ERROR] Location duplicate check failed: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Location duplicate check failed: %s", e)
         return False
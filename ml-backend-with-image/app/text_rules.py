@@ -2,7 +2,9 @@ import re
 
 
 def normalize(text: str) -> str:
-    return text.lower().strip()
+    # Already-normalized text (classify_report normalizes once up front)
+    # skips the lower() copy
+    return (text if text.islower() else text.lower()).strip()
 
 
 # ------------------------------------
@@ -18,6 +20,40 @@ def contains(text: str, keyword: str) -> bool:
     return re.search(rf"\b{re.escape(keyword)}\b", text) is not None
 
 
+_WORD = re.compile(r"\w+")
+
+
+def _phrase_index(phrases):
+    """Group phrases by word count, for _phrase_hits."""
+    index = {}
+    for phrase in phrases:
+        index.setdefault(len(_WORD.findall(phrase)), set()).add(phrase)
+    return tuple(sorted(index.items()))
+
+
+def _any_phrase_pattern(phrases):
+    """One compiled alternation matching any of phrases as a whole word/phrase
+    (same semantics as contains()); longest first so phrases win over their prefixes."""
+    alternation = "|".join(map(re.escape, sorted(set(phrases), key=len, reverse=True)))
+    return re.compile(rf"\b(?:{alternation})\b")
+
+
+def _phrase_hits(text: str, index):
+    """
+    Yield every indexed phrase found in text, with the same whole-word
+    semantics as contains(), in one pass over the words of text instead
+    of one regex search per phrase.
+    """
+    spans = [m.span() for m in _WORD.finditer(text)]
+    for i, (start, _) in enumerate(spans):
+        for n, phrases in index:
+            if i + n > len(spans):
+                break
+            candidate = text[start:spans[i + n - 1][1]]
+            if candidate in phrases:
+                yield candidate
+
+
 # ------------------------------------
 # Abusive words
 # ------------------------------------
@@ -55,9 +91,12 @@ ABUSIVE_WORDS = [
 
 
 
+_ABUSIVE_RE = _any_phrase_pattern(ABUSIVE_WORDS)
+
+
 def is_abusive(description: str) -> bool:
     text = normalize(description)
-    return any(contains(text, word) for word in ABUSIVE_WORDS)
+    return _ABUSIVE_RE.search(text) is not None
 
 
 # ------------------------------------
@@ -143,6 +182,14 @@ CATEGORY_KEYWORDS = {
 }
 
 
+_CATEGORY_INDEX = _phrase_index(kw for keywords in CATEGORY_KEYWORDS.values() for kw in keywords)
+# Average keyword length per category, for the specificity boost
+_AVG_KEYWORD_LENGTH = {
+    category: sum(len(kw) for kw in keywords) / max(len(keywords), 1)
+    for category, keywords in CATEGORY_KEYWORDS.items()
+}
+
+
 # ------------------------------------
 # Category detection (IMPROVED with confidence scoring)
 # ------------------------------------
@@ -161,8 +208,9 @@ def detect_category(description: str) -> tuple[str, float]:
     max_keyword_length = 0
     total_keywords_matched = 0
 
+    hits = set(_phrase_hits(text, _CATEGORY_INDEX))
     for category, keywords in CATEGORY_KEYWORDS.items():
-        matches = [kw for kw in keywords if contains(text, kw)]
+        matches = [kw for kw in keywords if kw in hits]
         score = len(matches)
 
         if score > max_score:
@@ -189,7 +237,7 @@ def detect_category(description: str) -> tuple[str, float]:
         
         # Boost for specific keywords (longer = more specific)
         # Normalize by average keyword length in best category
-        avg_keyword_length = sum(len(kw) for kw in CATEGORY_KEYWORDS.get(best_category, [])) / max(len(CATEGORY_KEYWORDS.get(best_category, [])), 1)
+        avg_keyword_length = _AVG_KEYWORD_LENGTH.get(best_category, 0)
         specificity_boost = min(max_keyword_length / (avg_keyword_length * 2), 0.3) if avg_keyword_length > 0 else 0
         
         confidence = min(base_confidence + specificity_boost, 1.0)
@@ -227,22 +275,22 @@ URGENCY_KEYWORDS = {
 }
 
 
+_HIGH_URGENCY_RE = _any_phrase_pattern(URGENCY_KEYWORDS["high"])
+_MEDIUM_URGENCY_RE = _any_phrase_pattern(URGENCY_KEYWORDS["medium"])
+
+
 # ------------------------------------
 # Urgency detection (SAFE OVERRIDE)
 # ------------------------------------
 def detect_urgency(description: str) -> str:
     text = normalize(description)
 
-    # Hard safety override
-    if any(contains(text, k) for k in ["dead", "fire", "collapse", "gas leak"]):
+    # Hard safety override ("dead", "fire", "collapse", "gas leak") is
+    # covered by the high list, so one precompiled search decides it
+    if _HIGH_URGENCY_RE.search(text):
         return "high"
 
-    for kw in URGENCY_KEYWORDS["high"]:
-        if contains(text, kw):
-            return "high"
-
-    for kw in URGENCY_KEYWORDS["medium"]:
-        if contains(text, kw):
-            return "medium"
+    if _MEDIUM_URGENCY_RE.search(text):
+        return "medium"
 
     return "low"
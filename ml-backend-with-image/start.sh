@@ -14,8 +14,13 @@ echo "=========================================="
 
 # Use uvicorn to start the FastAPI app with proper settings for Render
 # --timeout-keep-alive 75: Keep connections alive for Render's load balancer
-# --workers 1: Single worker for free tier
+# --workers: WEB_CONCURRENCY processes, default 1. Each worker loads its own
+#   CLIP (~600MB), and the duplicate check + save is only serialized within a
+#   process: workers share dataset.jsonl, but two of them can still both accept
+#   the same report submitted at the same moment. Prefer ML_WORKERS threads.
+# uvicorn's default loop/http ("auto") already use uvloop and httptools from
+#   uvicorn[standard] when they are installed.
 # --access-log: Enable access logging for debugging
 # --log-level info: Better logging
-exec uvicorn app.main:app --host 0.0.0.0 --port $PORT --workers 1 --timeout-keep-alive 75 --access-log --log-level info
-
+WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
+exec uvicorn app.main:app --host 0.0.0.0 --port $PORT --workers $WEB_CONCURRENCY --timeout-keep-alive 75 --access-log --log-level info
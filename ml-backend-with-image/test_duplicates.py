@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script to verify duplicate detection against dataset.jsonl
+"""
+import sys
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import orjson
+
+from app import dataset, storage
+
+
+@contextmanager
+def _dataset_file(lines):
+    """Point dataset/storage at a temporary dataset.jsonl holding `lines`."""
+    dataset.close()
+    saved_file, saved_index = dataset.DATA_FILE, storage._index
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "dataset.jsonl"
+        path.write_bytes(b"".join(line if isinstance(line, bytes) else orjson.dumps(line) + b"\n"
+                                  for line in lines))
+        dataset.DATA_FILE = path
+        storage._index = storage._AcceptedIndex()
+        try:
+            yield path
+        finally:
+            dataset.close()
+            dataset.DATA_FILE, storage._index = saved_file, saved_index
+
+
+def _accepted(report_id, description, latitude, longitude, **extra):
+    return {"report_id": report_id, "accept": True, "status": "accepted", "category": "Road & Traffic",
+            "user_id": "test_user", "description": description,
+            "latitude": latitude, "longitude": longitude, **extra}
+
+
+def test_malformed_records_dont_break_duplicate_checks():
+    """Malformed and non-finite records are skipped; the rest stay searchable"""
+    print("Testing duplicate checks with malformed dataset records...")
+
+    lines = [
+        _accepted("bad_nan", "pothole near the bus stop", "nan", 77.6),
+        _accepted("bad_inf", "pothole near the school", 12.9, float("inf")),
+        b"{not json\n",
+        b"[1, 2]\n",
+        _accepted("good", "big pothole on main street", 12.9, 77.6, image_hash="8000000000000000"),
+        _accepted("good_again", "another pothole on main street", 13.5, 77.9, image_hash="8000000000000000"),
+    ]
+    with _dataset_file(lines) as path:
+        assert storage.is_duplicate("test_user", "big pothole on main street", "Road & Traffic")
+        assert storage.is_duplicate("test_user", "pothole near the bus stop", "Road & Traffic")
+        assert storage.is_duplicate_location(12.9, 77.6, "", "Road & Traffic")
+        assert not storage.is_duplicate_location(40.0, 70.0, "", "Road & Traffic")
+        assert storage.is_duplicate_image_hash("8000000000000000")
+
+        # Later appends are still picked up, and re-reading adds no hash twice
+        with path.open("ab") as f:
+            f.write(orjson.dumps(_accepted("late", "pothole on the ring road", 20.0, 80.0)) + b"\n")
+        assert storage.is_duplicate_location(20.0, 80.0, "", "Road & Traffic")
+        assert storage._index.image_hashes.size == 1
+
+    print("✅ Malformed record handling PASSED")
+
+
+def test_concurrent_identical_submissions():
+    """Two identical reports classified at the same time: only one is accepted"""
+    print("\nTesting concurrent identical submissions...")
+    from app import pipeline
+
+    report = {"report_id": "race", "description": "big pothole on the ring road near the flyover",
+              "user_id": "test_user", "latitude": 12.95, "longitude": 77.65}
+    # Both requests get past the early duplicate checks before either saves
+    both_checked = threading.Barrier(2, timeout=10)
+    detect_urgency = pipeline.detect_urgency
+
+    def urgency_after_both_checked(text):
+        both_checked.wait()
+        return detect_urgency(text)
+
+    results = []
+    with _dataset_file([]):
+        pipeline.detect_urgency = urgency_after_both_checked
+        try:
+            threads = [threading.Thread(target=lambda: results.append(pipeline.classify_report(dict(report))))
+                       for _ in range(2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            pipeline.detect_urgency = detect_urgency
+
+    statuses = sorted(result["status"] for result in results)
+    print(f"Statuses: {statuses}")
+    assert statuses == ["accepted", "rejected"]
+    print("✅ Concurrent submission handling PASSED")
+
+
+if __name__ == "__main__":
+    test_malformed_records_dont_break_duplicate_checks()
+    test_concurrent_identical_submissions()
@@ -6,49 +6,57 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app.pipeline import classify_report
+# Per-case status labels
+_PASS = "✅ PASS"
+_FAIL = "❌ FAIL"
+
+# Report fields shared by every test case; each case fills in the rest
+_REPORT_TEMPLATE = {
+    "category": "Road & Traffic",
+    "user_id": "test_user",
+    "image_url": None,
+    "latitude": 12.9,
+    "longitude": 77.6
+}
+
+# Test cases: (description, should_be_rejected, test_name, report_id)
+_TEST_CASES = (
+    # Abusive language - should be rejected
+    ("This is a fucking pothole that needs fixing", True, "Explicit profanity", "test_explicit_profanity"),
+    ("What the hell is wrong with this road", True, "Mild profanity", "test_mild_profanity"),
+    ("This shit needs to be fixed immediately", True, "Strong profanity", "test_strong_profanity"),
+    ("You're an idiot for not fixing this", True, "Insult", "test_insult"),
+    ("This is crap and needs attention", True, "Mild profanity", "test_mild_profanity"),
+    
+    # Clean language - should be accepted
+    ("There is a large pothole on Main Street that needs repair", False, "Clean description", "test_clean_description"),
+    ("The street light is not working properly", False, "Clean technical issue", "test_clean_technical_issue"),
+    ("Water is leaking from the pipe", False, "Clean water issue", "test_clean_water_issue"),
+    ("Garbage is overflowing from the bin", False, "Clean sanitation issue", "test_clean_sanitation_issue"),
+    ("Park maintenance is needed", False, "Clean maintenance request", "test_clean_maintenance_request"),
+    
+    # Edge cases
+    ("FUCK this pothole", True, "All caps profanity", "test_all_caps_profanity"),
+    ("fuck this pothole", True, "Lowercase profanity", "test_lowercase_profanity"),
+    ("F*ck this pothole", False, "Censored profanity (might pass)", "test_censored_profanity_(might_pass)"),
+    ("This is a damn good road", True, "Profanity in positive context", "test_profanity_in_positive_context"),
+)
 
 def test_profanity_detection():
     """Test profanity detection with various abusive and clean texts"""
-    print("🧪 Testing Profanity Detection")
-    print("=" * 60)
-    
-    # Test cases: (description, should_be_rejected, test_name)
-    test_cases = [
-        # Abusive language - should be rejected
-        ("This is a fucking pothole that needs fixing", True, "Explicit profanity"),
-        ("What the hell is wrong with this road", True, "Mild profanity"),
-        ("This shit needs to be fixed immediately", True, "Strong profanity"),
-        ("You're an idiot for not fixing this", True, "Insult"),
-        ("This is crap and needs attention", True, "Mild profanity"),
-        
-        # Clean language - should be accepted
-        ("There is a large pothole on Main Street that needs repair", False, "Clean description"),
-        ("The street light is not working properly", False, "Clean technical issue"),
-        ("Water is leaking from the pipe", False, "Clean water issue"),
-        ("Garbage is overflowing from the bin", False, "Clean sanitation issue"),
-        ("Park maintenance is needed", False, "Clean maintenance request"),
-        
-        # Edge cases
-        ("FUCK this pothole", True, "All caps profanity"),
-        ("fuck this pothole", True, "Lowercase profanity"),
-        ("F*ck this pothole", False, "Censored profanity (might pass)"),
-        ("This is a damn good road", True, "Profanity in positive context"),
-    ]
+    # Imported here so collecting this file doesn't pull in torch/CLIP
+    from app.pipeline import classify_report
+
+    # Output is collected here and written once at the end
+    buf = ["🧪 Testing Profanity Detection\n", "=" * 60 + "\n"]
     
     passed = 0
     failed = 0
     
-    for desc, should_reject, test_name in test_cases:
-        report = {
-            "report_id": f"test_{test_name.replace(' ', '_').lower()}",
-            "description": desc,
-            "category": "Road & Traffic",
-            "user_id": "test_user",
-            "image_url": None,
-            "latitude": 12.9,
-            "longitude": 77.6
-        }
+    for desc, should_reject, test_name, report_id in _TEST_CASES:
+        report = _REPORT_TEMPLATE.copy()
+        report["report_id"] = report_id
+        report["description"] = desc
         
         result = classify_report(report)
         was_rejected = result.get("status") == "rejected"
@@ -56,26 +64,27 @@ def test_profanity_detection():
         
         # Check if result matches expectation
         if was_rejected == should_reject:
-            status = "✅ PASS"
+            status = _PASS
             passed += 1
         else:
-            status = "❌ FAIL"
+            status = _FAIL
             failed += 1
         
-        print(f"\n{status} - {test_name}")
-        print(f"  Description: \"{desc}\"")
-        print(f"  Expected: {'REJECTED' if should_reject else 'ACCEPTED'}")
-        print(f"  Got: {'REJECTED' if was_rejected else 'ACCEPTED'}")
+        buf.append(f"\n{status} - {test_name}\n")
+        buf.append(f"  Description: \"{desc}\"\n")
+        buf.append(f"  Expected: {'REJECTED' if should_reject else 'ACCEPTED'}\n")
+        buf.append(f"  Got: {'REJECTED' if was_rejected else 'ACCEPTED'}\n")
         if was_rejected:
-            print(f"  Reason: {reason}")
+            buf.append(f"  Reason: {reason}\n")
     
-    print("\n" + "=" * 60)
-    print(f"📊 Test Results: {passed} passed, {failed} failed out of {len(test_cases)} tests")
+    buf.append("\n" + "=" * 60 + "\n")
+    buf.append(f"📊 Test Results: {passed} passed, {failed} failed out of {len(_TEST_CASES)} tests\n")
     
     if failed == 0:
-        print("✅ All profanity detection tests PASSED!")
+        buf.append("✅ All profanity detection tests PASSED!\n")
     else:
-        print(f"❌ {failed} test(s) FAILED - profanity detection needs improvement")
+        buf.append(f"❌ {failed} test(s) FAILED - profanity detection needs improvement\n")
+    sys.stdout.write("".join(buf))
     
     return failed == 0
 